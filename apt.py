@@ -0,0 +1,175 @@
+import argparse
+import logging
+import math
+import wave
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("main.apt")
+
+# APT is a 2400 Hz AM subcarrier of 4160 words per second, 2 lines per second
+SAMPLE_RATE = 48000
+CARRIER = 2400
+WORD_RATE = 4160
+LINE_WORDS = 2080
+
+# Taps of the low-pass filter keeping the 2080 Hz video bandwidth
+FILTER_TAPS = 33
+
+# Sync A, seven 1040 Hz cycles starting every line
+SYNC_A = np.array([0] * 4 + [1, 1, 0, 0] * 7 + [0] * 7, dtype=np.float32)
+
+# Words a line start may drift from one line to the next
+MAX_DRIFT = 20
+
+# Levels mapped to black and white, as percentiles of the image
+BLACK, WHITE = 0.5, 99.5
+
+
+def _lowPass(sample_rate):
+    cutoff = LINE_WORDS / sample_rate
+    n = np.arange(FILTER_TAPS) - (FILTER_TAPS - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(FILTER_TAPS)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+# Turns the FM demodulated audio into APT words as it arrives. Written to
+# like a file so it can be fed by a stream pump.
+class AptDemodulator:
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.phase = 2 * math.pi * CARRIER / sample_rate
+        self.taps = _lowPass(sample_rate)
+        self.step = sample_rate / WORD_RATE
+
+        # State carried from one chunk to the next
+        self.leftover = b""
+        self.previous = np.zeros(1, dtype=np.float32)
+        self.history = np.zeros(FILTER_TAPS - 1, dtype=np.float32)
+        self.filtered = 0
+        self.words = list()
+
+    # Amplitude of the carrier from each pair of consecutive samples, exact
+    # for a sinusoid of the carrier frequency
+    def _envelope(self, samples):
+        current = samples
+        previous = np.concatenate((self.previous, samples[:-1]))
+        self.previous = samples[-1:]
+        power = (
+            current * current
+            + previous * previous
+            - 2 * current * previous * math.cos(self.phase)
+        )
+        return np.sqrt(np.maximum(power, 0)) / math.sin(self.phase)
+
+    # Feed signed 16 bit little endian samples
+    def write(self, chunk):
+        data = self.leftover + chunk
+        usable = len(data) - len(data) % 2
+        self.leftover = data[usable:]
+        if usable == 0:
+            return
+        samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32)
+        self.process(samples)
+
+    def process(self, samples):
+        envelope = self._envelope(samples)
+        extended = np.concatenate((self.history, envelope))
+        self.history = extended[-(FILTER_TAPS - 1) :]
+        filtered = np.convolve(extended, self.taps, mode="valid")
+
+        # Sample the filtered envelope at the word rate, filtered[i] being
+        # input sample self.filtered + i
+        start = self.filtered
+        end = start + len(filtered)
+        first = math.ceil(start / self.step) if start else 0
+        last = math.ceil(end / self.step)
+        if last > first:
+            positions = np.arange(first, last) * self.step - start
+            self.words.append(
+                np.interp(positions, np.arange(len(filtered)), filtered).astype(
+                    np.float32
+                )
+            )
+        self.filtered = end
+
+    def close(self):
+        pass
+
+    def samples(self):
+        if not self.words:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(self.words)
+
+
+# Start of each line, from the correlation with sync A. Each line gets the
+# best match near where the previous one predicts it, lines lost in noise
+# just following the prediction.
+def _lineStarts(words):
+    template = SYNC_A - SYNC_A.mean()
+    correlation = np.correlate(words - words.mean(), template, mode="valid")
+    usable = len(correlation) - LINE_WORDS + len(SYNC_A)
+    if usable <= 0:
+        return list()
+
+    starts = list()
+    expected = int(np.argmax(correlation[:LINE_WORDS]))
+    while expected < usable:
+        low = max(0, expected - MAX_DRIFT)
+        high = min(len(correlation), expected + MAX_DRIFT + 1)
+        best = low + int(np.argmax(correlation[low:high]))
+        if starts and correlation[best] <= 0:
+            best = expected
+        starts.append(best)
+        expected = best + LINE_WORDS
+    return [start for start in starts if start + LINE_WORDS <= len(words)]
+
+
+# Image of both APT channels side by side, from the demodulated words
+def decodeWords(words, rotate=False):
+    starts = _lineStarts(words)
+    if not starts:
+        raise ValueError("Too short to hold an APT line")
+    lines = np.stack([words[start : start + LINE_WORDS] for start in starts])
+
+    black, white = np.percentile(lines, (BLACK, WHITE))
+    pixels = (lines - black) * (255 / max(white - black, 1e-6))
+    pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+
+    # Ascending passes are seen upside down
+    if rotate:
+        pixels = pixels[::-1, ::-1]
+    return pixels
+
+
+def writeImage(words, output, rotate=False):
+    pixels = decodeWords(words, rotate)
+    Image.fromarray(pixels).save(output + ".png")
+    logger.info(f"Decoded {pixels.shape[0]} APT lines to '{output}.png'")
+
+
+# Decode an archived recording
+def decodeWAV(path, output, rotate=False):
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"'{path}' is not 16 bit")
+        channels = wav.getnchannels()
+        demodulator = AptDemodulator(wav.getframerate())
+        while True:
+            frames = wav.readframes(1 << 16)
+            if not frames:
+                break
+            samples = np.frombuffer(frames, dtype="<i2")[::channels]
+            demodulator.process(samples.astype(np.float32))
+    writeImage(demodulator.samples(), output, rotate)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Decode an APT recording")
+    parser.add_argument("wav", help="16 bit WAV recording")
+    parser.add_argument("output", help="output PNG, without its extension")
+    parser.add_argument("--rotate", action="store_true", help="rotate ascending passes")
+    args = parser.parse_args()
+    decodeWAV(args.wav, args.output, args.rotate)
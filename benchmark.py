@@ -0,0 +1,431 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from orbit_predictor.locations import Location
+from PIL import Image
+
+import config
+import core
+import doppler
+import passcache
+import passutils
+import planner
+import predict
+import rss
+import streaming
+from core import Radio, Recording, Satellite
+
+logger = logging.getLogger("main.benchmark")
+
+# Fixed start and station so results of different runs are comparable
+START = datetime(2026, 1, 1)
+STATION = Location("Benchmark", 39.3654895, 2.9406836, 10)
+
+SATELLITE_COUNTS = (5, 20, 50, 200)
+HORIZONS = (1, 7, 14)
+WORKER_COUNTS = (1, 2, 4)
+RSS_SIZES = (1000, 5000)
+
+# Stand-ins for the external programs, taking about as long as STUB_DELAY
+# and writing the files the real ones would
+STUB_DELAY = 0.05
+STUB_BYTES = 64 << 20
+STUBS = {
+    "rtl_fm": """
+exec head -c "$STUB_BYTES" /dev/zero
+""",
+    "meteor_demod": """
+sleep $STUB_DELAY; for a; do last="$a"; done; head -c 1048576 /dev/zero > "$last"
+""",
+    "medet": """
+sleep $STUB_DELAY; cp "$STUB_BITMAP" "$2.bmp"
+""",
+    "noaa-apt": """
+sleep $STUB_DELAY; for a; do last="$a"; done; cp "$STUB_BITMAP" "$last"
+""",
+    "ffmpeg": """
+sleep $STUB_DELAY; for a; do last="$a"; done; cp "$STUB_BITMAP" "$last"
+""",
+}
+
+
+# TLE line with its checksum
+def _checksum(line):
+    total = sum(int(c) if c.isdigit() else c == "-" for c in line[:68])
+    return line[:68] + str(total % 10)
+
+
+# Sun-synchronous satellites like NOAA and METEOR, spread over orbit planes
+# and along them
+def syntheticSatellites(count):
+    epoch = START.strftime("%y%j") + ".00000000"
+    satellites = list()
+    for i in range(count):
+        norad = 90000 + i
+        satellite = Satellite(
+            f"BENCH {i}",
+            norad,
+            i % 3,
+            20,
+            137.1 if i % 2 else 137.9,
+            "APT" if i % 2 else "LRPT",
+            True,
+        )
+        satellite.tle_1 = _checksum(
+            f"1 {norad:05d}U 26001A   {epoch}  .00000100  00000-0  80000-4 0  999 "
+        )
+        satellite.tle_2 = _checksum(
+            f"2 {norad:05d}  98.7000 {(i * 137.508) % 360:8.4f} 0013000 "
+            f"200.0000 {(i * 73.0) % 360:8.4f} 14.12800000    10 "
+        )
+        satellites.append(satellite)
+    return satellites
+
+
+# Point the configuration at a scratch directory and the benchmark station
+def _configure(workdir, satellites=()):
+    config.output_dir = workdir
+    config.location = STATION
+    config.satellites = list(satellites)
+    config.prediction_horizon = 7
+    config.maximum_overlap = 7
+    config.radios = [Radio(0, 0, -6)]
+    config.streaming_enabled = False
+    config.streaming_archive_raw = False
+    config.doppler_enabled = False
+    config.apt_native = False
+    config.apt_archive_wav = False
+    config.capture_enabled = True
+    config.capture_buffer = 32
+    config.decoding_timeout = 30
+    config.decoding_queue_size = 16
+    config.decoding_niceness = 0
+    config.imaging_in_process = True
+    config.imaging_compression = 6
+    config.imaging_correct_geometry = True
+    config.imaging_keep_uncorrected = False
+    config.rss_enabled = False
+    config.post_processing_hook_enabled = False
+    config.metrics_pass_summary = True
+    _resetCache(workdir)
+
+
+# Start over with an empty pass cache
+def _resetCache(workdir):
+    if passcache.connection is not None:
+        passcache.connection.close()
+        passcache.connection = None
+    try:
+        os.remove(os.path.join(workdir, "passes.db"))
+    except FileNotFoundError:
+        pass
+
+
+def _timeRuns(function, repeat):
+    runs = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def _result(runs, **extra):
+    return {"seconds": statistics.median(runs), "runs": runs, **extra}
+
+
+# Pass prediction, cached lookups and conflict resolution as done by updatePass
+def benchPrediction(workdir, repeat, counts, horizons):
+    results = dict()
+    for count in counts:
+        satellites = syntheticSatellites(count)
+        for days in horizons:
+            _configure(workdir, satellites)
+            passes = predict.predictPasses(satellites, start=START, days=days)
+            results[f"prediction/{count}sat/{days}d"] = _result(
+                _timeRuns(
+                    lambda: predict.predictPasses(satellites, start=START, days=days),
+                    repeat,
+                ),
+                passes=len(passes),
+            )
+
+            cold = list()
+            for _ in range(repeat):
+                _resetCache(workdir)
+                start = time.perf_counter()
+                passcache.getPasses(satellites, START, days)
+                cold.append(time.perf_counter() - start)
+            results[f"pass_cache_miss/{count}sat/{days}d"] = _result(cold)
+            results[f"pass_cache_hit/{count}sat/{days}d"] = _result(
+                _timeRuns(lambda: passcache.getPasses(satellites, START, days), repeat)
+            )
+
+            for radios in (1, 2):
+                plan = planner.planPasses(passes, radios=radios)
+                results[f"planning/{count}sat/{days}d/{radios}radio"] = _result(
+                    _timeRuns(
+                        lambda: planner.planPasses(passes, radios=radios), repeat
+                    ),
+                    planned=len(plan.planned),
+                )
+    _resetCache(workdir)
+    return results
+
+
+# Write the stub programs and the bitmap they produce, putting them first in
+# the PATH
+def _installStubs(workdir):
+    bin_dir = os.path.join(workdir, "bin")
+    os.makedirs(bin_dir)
+    for name, script in STUBS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh" + script)
+        os.chmod(path, 0o755)
+
+    # Smooth, noisy picture of about 4 minutes of MSU-MR lines
+    bitmap = os.path.join(workdir, "stub.bmp")
+    rows, columns = np.mgrid[0:1500, 0:1568]
+    pixels = 128 + 60 * np.sin(rows / 90) * np.cos(columns / 140)
+    pixels += np.random.default_rng(0).normal(0, 8, pixels.shape)
+    pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    Image.fromarray(np.dstack([pixels] * 3)).save(bitmap)
+
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    os.environ["STUB_BITMAP"] = bitmap
+    os.environ["STUB_DELAY"] = str(STUB_DELAY)
+    os.environ["STUB_BYTES"] = str(STUB_BYTES)
+
+
+# Images a recording decodes to
+def _outputs(recording):
+    if recording.satellite.downlink == "APT":
+        return [recording.filename + ".png"]
+    return [
+        f"{recording.filename}-{channel}.png" for channel in passutils.LRPT_CHANNELS
+    ]
+
+
+# Recordings decoded per second by the decoding workers, external programs
+# replaced by stubs so the pipeline overhead and in-process imaging dominate
+def benchDecoding(workdir, repeat, worker_counts, recordings=8):
+    satellites = syntheticSatellites(2)
+    _configure(workdir, satellites)
+    passes = predict.predictPasses(satellites, start=START, days=2)
+
+    # Noise rather than zeros, silent captures not being decoded
+    noise = np.random.default_rng(0).integers(
+        -(1 << 15), 1 << 15, 1 << 19, dtype=np.int16
+    )
+
+    results = dict()
+    for workers in worker_counts:
+        config.decoding_workers = workers
+        core.initDecoder(passutils.decodeRecording)
+        runs = list()
+        for _ in range(repeat):
+            # Start from empty directories, decoders skipping the recordings
+            # whose outputs already exist
+            for satellite in satellites:
+                shutil.rmtree(os.path.join(workdir, satellite.name), True)
+                os.makedirs(os.path.join(workdir, satellite.name))
+
+            queued = list()
+            for i in range(recordings):
+                passobj = passes[i % len(passes)]
+                satellite = passobj.satellite
+                filename = os.path.join(workdir, satellite.name, f"bench_{i}")
+                extension = ".wav" if satellite.downlink == "APT" else ".raw"
+                noise.tofile(filename + extension)
+                queued.append(Recording(satellite, filename, START, passobj))
+
+            start = time.perf_counter()
+            for recording in queued:
+                core.decoder.submit(recording)
+            core.decoder.queue.join()
+            runs.append(time.perf_counter() - start)
+
+            # The timing means nothing unless the stubs produced every image
+            for recording in queued:
+                for path in _outputs(recording):
+                    if not os.path.exists(path):
+                        raise RuntimeError(f"Decoding did not produce '{path}'")
+        core.decoder.shutdown()
+        results[f"decoding/{workers}worker"] = _result(
+            runs, recordings_per_second=recordings / statistics.median(runs)
+        )
+    return results
+
+
+# Throughput of a receiver output through the stream pump, with and without
+# Doppler correction, in IQ bytes per second. LRPT is 0.56 MB/s.
+def benchRecording(workdir, repeat):
+    satellite = syntheticSatellites(1)[0]
+    _configure(workdir, [satellite])
+
+    results = dict()
+    for corrected in (False, True):
+        runs = list()
+        for _ in range(repeat):
+            corrector = None
+            if corrected:
+                corrector = doppler.DopplerCorrector(
+                    satellite,
+                    START,
+                    START + timedelta(seconds=STUB_BYTES / 4 / 140000 + 60),
+                    140000,
+                )
+            receiver = subprocess.Popen(["rtl_fm", "-"], stdout=subprocess.PIPE)
+            start = time.perf_counter()
+            stream_pump = streaming.pump(
+                receiver.stdout, [open(os.devnull, "wb")], corrector
+            )
+            stream_pump.join()
+            runs.append(stream_pump.bytes_copied / (time.perf_counter() - start) / 1e6)
+            receiver.wait()
+        name = "recording/doppler" if corrected else "recording/plain"
+        results[name] = {"megabytes_per_second": statistics.median(runs), "runs": runs}
+    return results
+
+
+# Cost of adding a pass to feeds holding thousands of items, and of
+# restoring them at startup
+def benchRSS(workdir, repeat, sizes, additions=20):
+    satellites = syntheticSatellites(2)
+    _configure(workdir, satellites)
+    passes = predict.predictPasses(satellites, start=START, days=1)
+
+    results = dict()
+    for size in sizes:
+        config.rss_max_items = size
+        rss.loadItems()
+        for i in range(size):
+            passobj = passes[i % len(passes)]
+            rss.items.append(
+                {
+                    "id": f"{passobj.satellite.name}/bench_{i}",
+                    "title": f"{passobj.satellite.name} bench {i}",
+                    "content_html": f'<img src="bench_{i}.png">',
+                    "date_published": (START + timedelta(minutes=i)).isoformat()
+                    + "+00:00",
+                }
+            )
+        rss.writeFeeds()
+
+        def add():
+            for i in range(additions):
+                passobj = passes[i % len(passes)]
+                rss.addRSSPass(passobj.satellite, f"bench_{i}", START, passobj)
+
+        runs = _timeRuns(add, repeat)
+        results[f"rss_add/{size}items"] = _result([run / additions for run in runs])
+        results[f"rss_load/{size}items"] = _result(_timeRuns(rss.loadItems, repeat))
+    return results
+
+
+# Cases slower than the baseline by more than threshold, as ratios
+def compare(results, baseline, threshold):
+    regressions = dict()
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if "seconds" in result and previous.get("seconds"):
+            ratio = result["seconds"] / previous["seconds"]
+        elif "megabytes_per_second" in result and result["megabytes_per_second"]:
+            ratio = previous["megabytes_per_second"] / result["megabytes_per_second"]
+        else:
+            continue
+        print(f"{name:45} {ratio:6.2f}x")
+        if ratio > threshold:
+            regressions[name] = ratio
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Auto137 hot paths")
+    parser.add_argument(
+        "--output", default="benchmark.json", help="where to write the results"
+    )
+    parser.add_argument("--compare", help="results of a previous run to compare to")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="slowdown ratio reported as a regression",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each case")
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        choices=("prediction", "decoding", "recording", "rss"),
+        default=("prediction", "decoding", "recording", "rss"),
+    )
+    parser.add_argument("--quick", action="store_true", help="only the smallest cases")
+    args = parser.parse_args()
+
+    counts = SATELLITE_COUNTS[:2] if args.quick else SATELLITE_COUNTS
+    horizons = HORIZONS[:2] if args.quick else HORIZONS
+    worker_counts = WORKER_COUNTS[:2] if args.quick else WORKER_COUNTS
+    sizes = RSS_SIZES[:1] if args.quick else RSS_SIZES
+
+    workdir = tempfile.mkdtemp(prefix="auto137-benchmark-")
+    results = dict()
+    try:
+        _installStubs(workdir)
+        core.initScheduler()
+        if "prediction" in args.only:
+            results.update(benchPrediction(workdir, args.repeat, counts, horizons))
+        if "decoding" in args.only:
+            results.update(benchDecoding(workdir, args.repeat, worker_counts))
+        if "recording" in args.only:
+            results.update(benchRecording(workdir, args.repeat))
+        if "rss" in args.only:
+            results.update(benchRSS(workdir, args.repeat, sizes))
+    finally:
+        core.scheduler.shutdown(wait=False)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for name, result in results.items():
+        if "seconds" in result:
+            print(f"{name:45} {result['seconds'] * 1000:10.2f} ms")
+        else:
+            print(f"{name:45} {result['megabytes_per_second']:10.2f} MB/s")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "date": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "repeat": args.repeat,
+                "results": results,
+            },
+            f,
+            indent=1,
+        )
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold}x")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
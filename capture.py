@@ -0,0 +1,141 @@
+import logging
+import os
+import time
+from queue import Full, Queue
+from threading import Thread
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger("main.capture")
+
+# Size of the writes to the disk, and of the steps the file grows by
+CHUNK_SIZE = 4 << 20
+
+# Samples looked at to tell if a capture holds anything
+SILENCE_PROBES = 1 << 16
+
+
+# Writes a receiver's IQ samples to a preallocated file from its own thread.
+# The stream pump hands it full chunks through a bounded buffer, so the
+# receiver keeps being read while the disk stalls. Used as a stream sink.
+class CaptureWriter:
+    def __init__(self, path, expected_bytes, buffer_bytes, byte_rate):
+        self.path = path
+        self.byte_rate = byte_rate
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.allocated = 0
+        self._allocate(expected_bytes)
+
+        self.chunk = bytearray(CHUNK_SIZE)
+        self.filled = 0
+        self.queue = Queue(maxsize=max(1, buffer_bytes // CHUNK_SIZE))
+        self.written = 0
+        self.received = 0
+        self.stalls = 0
+        self.stalled = 0.0
+        self.started = None
+        self.finished = None
+
+        self.thread = Thread(target=self._work, name="capture", daemon=True)
+        self.thread.start()
+
+    # Reserve the blocks of the file ahead so writes never wait for the
+    # filesystem to find room
+    def _allocate(self, size):
+        size = -(-size // CHUNK_SIZE) * CHUNK_SIZE
+        if size <= self.allocated:
+            return
+        try:
+            os.posix_fallocate(self.fd, self.allocated, size - self.allocated)
+        except (AttributeError, OSError):
+            os.ftruncate(self.fd, size)
+        self.allocated = size
+
+    def write(self, data):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.received += len(data)
+        view = memoryview(data)
+        while len(view) > 0:
+            count = min(len(view), CHUNK_SIZE - self.filled)
+            self.chunk[self.filled : self.filled + count] = view[:count]
+            self.filled += count
+            view = view[count:]
+            if self.filled == CHUNK_SIZE:
+                self._hand(bytes(self.chunk))
+                self.filled = 0
+
+    def _hand(self, chunk):
+        try:
+            self.queue.put_nowait(chunk)
+        except Full:
+            # The disk can't keep up, samples may get lost while we wait
+            start = time.monotonic()
+            self.queue.put(chunk)
+            self.stalls += 1
+            self.stalled += time.monotonic() - start
+
+    def _work(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+            self._allocate(self.written + len(chunk))
+            view = memoryview(chunk)
+            while len(view) > 0:
+                count = os.pwrite(self.fd, view, self.written)
+                self.written += count
+                view = view[count:]
+
+    def close(self):
+        if self.filled > 0:
+            self._hand(bytes(self.chunk[: self.filled]))
+            self.filled = 0
+        if self.started is not None:
+            self.finished = time.monotonic()
+        self.queue.put(None)
+        self.thread.join()
+        os.ftruncate(self.fd, self.written)
+        os.fsync(self.fd)
+        os.close(self.fd)
+
+        if self.stalls > 0:
+            logger.warning(
+                f"Capture '{self.path}' waited {self.stalled:.1f}s for the disk "
+                f"{self.stalls} time(s)"
+            )
+        metrics.increment("auto137_capture_stalls_total", self.stalls)
+
+    # Bytes missing from the capture, from how long it was received for
+    def missing(self):
+        if self.started is None:
+            return 0
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return max(0, int(elapsed * self.byte_rate) - self.received)
+
+    def report(self):
+        return {
+            "captured_bytes": self.written,
+            "capture_stalls": self.stalls,
+            "capture_stalled": self.stalled,
+            "capture_missing_bytes": self.missing(),
+        }
+
+
+# Zero-copy view of a completed capture as interleaved I/Q samples
+def view(path):
+    if os.path.getsize(path) < 4:
+        return np.zeros(0, dtype=np.int16)
+    return np.memmap(path, dtype=np.int16, mode="r")
+
+
+# Whether a capture holds nothing but silence, like when the receiver failed,
+# looking at samples spread over the whole file
+def isSilent(path):
+    samples = view(path)
+    if samples.size == 0:
+        return True
+    probes = samples[:: max(1, samples.size // SILENCE_PROBES)]
+    return not np.any(probes)
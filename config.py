@@ -1,20 +1,86 @@
 import yaml
 import io
-from core import Satellite
-from orbit_predictor.locations import Location
+from core import Radio, Satellite
 
 
 # Config objects
+config_file = str()
+hot_reload = bool()
 satellites = list()
+radios = list()
 tle_update_interval = int()
+fast_start = bool()
+tle_groups = list()
+tle_file = str()
+tle_max_age = int()
 location = 0
 output_dir = str()
 maximum_overlap = 0
+prediction_horizon = 0
+
+# Streaming config
+streaming_enabled = bool()
+streaming_archive_raw = bool()
+
+# Doppler config
+doppler_enabled = bool()
+
+# Capture config
+capture_enabled = bool()
+capture_buffer = int()
+
+# Decoding config
+decoding_workers = int()
+decoding_timeout = int()
+decoding_queue_size = int()
+decoding_niceness = int()
+
+# APT config
+apt_native = bool()
+apt_archive_wav = bool()
+
+# Imaging config
+imaging_in_process = bool()
+imaging_compression = int()
+imaging_correct_geometry = bool()
+imaging_keep_uncorrected = bool()
 
 # RSS config
 rss_enabled = bool()
 rss_port = int()
 rss_webserver = bool()
+rss_max_items = int()
+
+# Storage config
+storage_min_free = int()
+storage_max_size = int()
+storage_max_age = int()
+storage_compress_raw = bool()
+
+# Fleet config
+fleet_enabled = bool()
+fleet_url = str()
+fleet_station = str()
+fleet_timeout = int()
+fleet_coordinator = bool()
+fleet_port = int()
+
+# Metrics config
+metrics_enabled = bool()
+metrics_port = int()
+metrics_pass_summary = bool()
+
+# Publisher config
+publisher_enabled = bool()
+publisher_backend = str()
+publisher_url = str()
+publisher_token = str()
+publisher_max_size = int()
+publisher_min_elevation = int()
+publisher_daytime_only = bool()
+publisher_queue_size = int()
+publisher_retries = int()
+publisher_retry_delay = int()
 
 # Post-Processing hook config
 post_processing_hook_command = str()
@@ -23,85 +89,301 @@ post_processing_hook_foreach = bool()
 
 post_processing_hook_min_elevation = int()
 post_processing_hook_daytime_only = bool()
+post_processing_hook_workers = int()
+post_processing_hook_queue_size = int()
+post_processing_hook_timeout = int()
+post_processing_hook_retries = int()
+post_processing_hook_retry_delay = int()
+post_processing_hook_batch_window = int()
 
-def loadConfig(file):
-    global satellites, tle_update_interval, location, output_dir, rss_enabled, rss_port, rss_webserver, post_processing_hook_command, post_processing_hook_enabled, post_processing_hook_foreach, maximum_overlap
-    global post_processing_hook_min_elevation, post_processing_hook_daytime_only
+# Raised with every problem found in a configuration file
+class ConfigError(ValueError):
+    pass
 
-    # Open our file
-    f = io.open(file, mode="r", encoding="utf-8")
 
-    # Parse it
-    config = yaml.load(f, Loader=yaml.FullLoader)
+# Marks the settings that must be given
+REQUIRED = object()
 
-    # Software options
-    tle_update_interval = int(config["config"]["tle_update_interval"])
-    output_dir = str(config["config"]["output_dir"])
-    maximum_overlap = int(config["config"]["max_overlap"])
 
-    # RSS
-    rss_enabled = bool(config["config"]["rss"]["enabled"])
-    rss_webserver = bool(config["config"]["rss"]["webserver"])
-    rss_port = int(config["config"]["rss"]["port"])
+# Checks of a setting's value, returning the problem if any
+def between(low=None, high=None):
+    def check(value):
+        if low is not None and value < low:
+            return f"must be at least {low}"
+        if high is not None and value > high:
+            return f"must be at most {high}"
+    return check
 
-    # Post-Processing Hook
-    post_processing_hook_command = str(
-        config["config"]["post_processing_hook"]["command"]
-    )
-    post_processing_hook_enabled = bool(
-        config["config"]["post_processing_hook"]["enabled"]
-    )
-    post_processing_hook_foreach = bool(
-        config["config"]["post_processing_hook"]["run_foreach"]
-    )
-    post_processing_hook_min_elevation = int(
-        config["config"]["post_processing_hook"]["min_elevation"]
-    )
-    post_processing_hook_daytime_only = bool(
-        config["config"]["post_processing_hook"]["daytime_only"]
+
+def oneOf(*choices):
+    def check(value):
+        if value not in choices:
+            return "must be one of " + ", ".join(str(choice) for choice in choices)
+    return check
+
+
+POSITIVE = between(1)
+NOT_NEGATIVE = between(0)
+PORT = between(1, 65535)
+
+# Settings of the config section: global name, path, type, default and check
+SETTINGS = [
+    ("tle_update_interval", "tle_update_interval", int, REQUIRED, POSITIVE),
+    ("tle_groups", "tle.groups", list, ["weather"], None),
+    ("tle_file", "tle.file", str, "", None),
+    ("tle_max_age", "tle.max_age", int, 14, POSITIVE),
+    ("output_dir", "output_dir", str, REQUIRED, None),
+    ("maximum_overlap", "max_overlap", int, REQUIRED, NOT_NEGATIVE),
+    ("prediction_horizon", "prediction_horizon", int, 7, POSITIVE),
+    ("fast_start", "fast_start", bool, True, None),
+    ("hot_reload", "hot_reload", bool, True, None),
+    ("streaming_enabled", "streaming.enabled", bool, False, None),
+    ("streaming_archive_raw", "streaming.archive_raw", bool, False, None),
+    ("doppler_enabled", "doppler_correction", bool, False, None),
+    ("capture_enabled", "capture.enabled", bool, True, None),
+    ("capture_buffer", "capture.buffer_mb", int, 32, POSITIVE),
+    ("decoding_workers", "decoding.workers", int, 1, POSITIVE),
+    ("decoding_timeout", "decoding.timeout", int, 30, POSITIVE),
+    ("decoding_queue_size", "decoding.queue_size", int, 16, POSITIVE),
+    ("decoding_niceness", "decoding.niceness", int, 10, between(-20, 19)),
+    ("apt_native", "apt.native", bool, False, None),
+    ("apt_archive_wav", "apt.archive_wav", bool, False, None),
+    ("imaging_in_process", "imaging.in_process", bool, True, None),
+    ("imaging_compression", "imaging.compression", int, 6, between(0, 9)),
+    ("imaging_correct_geometry", "imaging.correct_geometry", bool, True, None),
+    ("imaging_keep_uncorrected", "imaging.keep_uncorrected", bool, False, None),
+    ("rss_enabled", "rss.enabled", bool, REQUIRED, None),
+    ("rss_webserver", "rss.webserver", bool, REQUIRED, None),
+    ("rss_port", "rss.port", int, REQUIRED, PORT),
+    ("rss_max_items", "rss.max_items", int, 50, POSITIVE),
+    ("storage_min_free", "storage.min_free_mb", int, 500, NOT_NEGATIVE),
+    ("storage_max_size", "storage.max_size_mb", int, 0, NOT_NEGATIVE),
+    ("storage_max_age", "storage.max_age_days", int, 0, NOT_NEGATIVE),
+    ("storage_compress_raw", "storage.compress_raw", bool, False, None),
+    ("fleet_enabled", "fleet.enabled", bool, False, None),
+    ("fleet_url", "fleet.url", str, "http://localhost:9138/schedule", None),
+    ("fleet_station", "fleet.station", str, "", None),
+    ("fleet_timeout", "fleet.timeout", int, 10, POSITIVE),
+    ("fleet_coordinator", "fleet.coordinator", bool, False, None),
+    ("fleet_port", "fleet.port", int, 9138, PORT),
+    ("metrics_enabled", "metrics.enabled", bool, False, None),
+    ("metrics_port", "metrics.port", int, 9137, PORT),
+    ("metrics_pass_summary", "metrics.pass_summary", bool, True, None),
+    ("publisher_enabled", "publisher.enabled", bool, False, None),
+    ("publisher_backend", "publisher.backend", str, "twitter", oneOf("twitter", "http")),
+    ("publisher_url", "publisher.url", str, "", None),
+    ("publisher_token", "publisher.token", str, "", None),
+    ("publisher_max_size", "publisher.max_size_kb", int, 5000, POSITIVE),
+    ("publisher_min_elevation", "publisher.min_elevation", int, 40, between(0, 90)),
+    ("publisher_daytime_only", "publisher.daytime_only", bool, True, None),
+    ("publisher_queue_size", "publisher.queue_size", int, 32, POSITIVE),
+    ("publisher_retries", "publisher.retries", int, 2, NOT_NEGATIVE),
+    ("publisher_retry_delay", "publisher.retry_delay", int, 60, NOT_NEGATIVE),
+    ("post_processing_hook_command", "post_processing_hook.command", str, REQUIRED, None),
+    ("post_processing_hook_enabled", "post_processing_hook.enabled", bool, REQUIRED, None),
+    ("post_processing_hook_foreach", "post_processing_hook.run_foreach", bool, REQUIRED, None),
+    ("post_processing_hook_min_elevation", "post_processing_hook.min_elevation", int, REQUIRED, between(0, 90)),
+    ("post_processing_hook_daytime_only", "post_processing_hook.daytime_only", bool, REQUIRED, None),
+    ("post_processing_hook_workers", "post_processing_hook.workers", int, 1, POSITIVE),
+    ("post_processing_hook_queue_size", "post_processing_hook.queue_size", int, 32, POSITIVE),
+    ("post_processing_hook_timeout", "post_processing_hook.timeout", int, 300, POSITIVE),
+    ("post_processing_hook_retries", "post_processing_hook.retries", int, 2, NOT_NEGATIVE),
+    ("post_processing_hook_retry_delay", "post_processing_hook.retry_delay", int, 30, NOT_NEGATIVE),
+    ("post_processing_hook_batch_window", "post_processing_hook.batch_window", int, 0, NOT_NEGATIVE),
+]
+
+# Settings of the station, in the config section
+STATION_SETTINGS = [
+    ("latitude", float, REQUIRED, between(-90, 90)),
+    ("longitude", float, REQUIRED, between(-180, 180)),
+    ("elevation", float, REQUIRED, None),
+]
+
+# Settings of each radio, by device index or serial
+RADIO_SETTINGS = [
+    ("device", (int, str), REQUIRED, None),
+    ("ppm", int, -6, None),
+]
+
+# Settings of each satellite
+SATELLITE_SETTINGS = [
+    ("name", str, REQUIRED, None),
+    ("norad", int, REQUIRED, POSITIVE),
+    ("priority", int, REQUIRED, NOT_NEGATIVE),
+    ("min_elevation", float, REQUIRED, between(0, 90)),
+    ("frequency", float, REQUIRED, POSITIVE),
+    ("downlink", str, REQUIRED, oneOf("APT", "LRPT")),
+    ("delete_processed_files", bool, REQUIRED, None),
+    ("max_size_mb", int, 0, NOT_NEGATIVE),
+]
+
+TYPE_NAMES = {
+    int: "an integer",
+    float: "a number",
+    bool: "true or false",
+    str: "a string",
+    list: "a list of strings",
+    (int, str): "an index or a serial",
+}
+
+
+# Value of a setting converted to its type, or the problem with it
+def _convert(value, kind):
+    if kind is bool:
+        valid = isinstance(value, bool)
+    elif kind is float:
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool)
+        value = float(value) if valid else value
+    elif kind is list:
+        valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+    else:
+        valid = isinstance(value, kind) and not isinstance(value, bool)
+    if not valid:
+        raise ValueError(f"must be {TYPE_NAMES[kind]}, not {value!r}")
+    return value
+
+
+# Read a setting at a dotted path of a section, adding any problem to errors
+def _read(section, prefix, path, kind, default, check, errors):
+    value = section
+    for key in path.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    if value is None:
+        if default is REQUIRED:
+            errors.append(f"{prefix}{path} is missing")
+        return default
+    try:
+        value = _convert(value, kind)
+    except ValueError as ex:
+        errors.append(f"{prefix}{path} {ex}")
+        return default
+    problem = check(value) if check is not None else None
+    if problem is not None:
+        errors.append(f"{prefix}{path} {problem} ({value!r})")
+        return default
+    return value
+
+
+def _readAll(section, prefix, settings, errors):
+    return {
+        name: _read(section, prefix, name, kind, default, check, errors)
+        for name, kind, default, check in settings
+    }
+
+
+# Parse and validate a configuration file without applying it. Every problem
+# found is reported at once in a ConfigError.
+def parseConfig(file):
+    with io.open(file, mode="r", encoding="utf-8") as f:
+        try:
+            document = yaml.load(f, Loader=yaml.FullLoader)
+        except yaml.YAMLError as ex:
+            raise ConfigError(f"{file} is not valid YAML: {ex}")
+    if not isinstance(document, dict) or not isinstance(document.get("config"), dict):
+        raise ConfigError(f"{file} has no config section")
+
+    errors = list()
+    section = document["config"]
+    values = {
+        name: _read(section, "config.", path, kind, default, check, errors)
+        for name, path, kind, default, check in SETTINGS
+    }
+    values["config_file"] = file
+
+    # Ground station
+    station = _readAll(
+        section.get("station") or {}, "config.station.", STATION_SETTINGS, errors
     )
+    if not errors:
+        from orbit_predictor.locations import Location
+        values["location"] = Location(
+            "Station", station["latitude"], station["longitude"], station["elevation"]
+        )
+
+    # Radios, a single rtl_sdr device 0 if none are defined
+    values["radios"] = list()
+    entries = section.get("radios") or [{"device": 0}]
+    if not isinstance(entries, list):
+        errors.append("config.radios must be a list")
+        entries = list()
+    for index, entry in enumerate(entries):
+        prefix = f"config.radios[{index}]."
+        entry = entry if isinstance(entry, dict) else {}
+        radio = _readAll(entry, prefix, RADIO_SETTINGS, errors)
+        values["radios"].append(Radio(index, radio["device"], radio["ppm"]))
+
+    # Satellites
+    values["satellites"] = list()
+    entries = document.get("satellites")
+    if not isinstance(entries, list) or not entries:
+        errors.append("satellites must be a list of at least one satellite")
+        entries = list()
+    seen = dict()
+    for index, entry in enumerate(entries):
+        prefix = f"satellites[{index}]."
+        entry = entry if isinstance(entry, dict) else {}
+        sat = _readAll(entry, prefix, SATELLITE_SETTINGS, errors)
+        if sat["norad"] is REQUIRED or sat["name"] is REQUIRED:
+            continue
+        for key in ("norad", "name"):
+            if (key, sat[key]) in seen:
+                other = seen[key, sat[key]]
+                errors.append(f"{prefix}{key} {sat[key]!r} is also satellites[{other}]")
+            seen[key, sat[key]] = index
+        satellite = Satellite(
+            sat["name"],
+            sat["norad"],
+            sat["priority"],
+            sat["min_elevation"],
+            sat["frequency"],
+            sat["downlink"],
+            sat["delete_processed_files"],
+        )
+        satellite.max_size_mb = sat["max_size_mb"]
+        values["satellites"].append(satellite)
 
+    if errors:
+        raise ConfigError(f"{file} is invalid:\n  " + "\n  ".join(errors))
+    return values
+
+
+# Make parsed settings the current ones
+def applyConfig(values):
+    globals().update(values)
+
+
+def loadConfig(file):
+    applyConfig(parseConfig(file))
+
+
+# Print the loaded configuration, kept apart from loading so tools can load it
+# quietly
+def printConfig():
     print("TLE Update interval : " + str(tle_update_interval) + " hour(s)")
+    print("TLE source          : " + (tle_file or "Celestrak " + ", ".join(tle_groups)))
+    print("Prediction horizon  : " + str(prediction_horizon) + " day(s)")
     print("\n")
 
-    # Ground station
-    latitude = config["config"]["station"]["latitude"]
-    longitude = config["config"]["station"]["longitude"]
-    elevation = config["config"]["station"]["elevation"]
     print("Groud station :")
-    print("    Latitude     : " + str(latitude))
-    print("    Longitude    : " + str(longitude))
-    print("    Elevation    : " + str(elevation))
+    print("    Latitude     : " + str(location.latitude_deg))
+    print("    Longitude    : " + str(location.longitude_deg))
+    print("    Elevation    : " + str(location.elevation_m))
+    print("\n")
+
+    for radio in radios:
+        print("Radio " + str(radio.index) + " :")
+        print("    Device       : " + str(radio.device))
+        print("    PPM error    : " + str(radio.ppm))
     print("\n")
-    location = Location("Station", latitude, longitude, elevation)
-
-    # Load satellites
-    for sat in config["satellites"]:
-        name = sat["name"]
-        norad = sat["norad"]
-        priority = sat["priority"]
-        min_elevation = sat["min_elevation"]
-        frequency = sat["frequency"]
-        downlink = sat["downlink"]
-        delete_processed_files = sat["delete_processed_files"]
-
-        print("Adding " + name + " :")
-        print("     NORAD                   : " + str(norad))
-        print("     Priority                : " + str(priority))
-        print("     Minimum elevation       : " + str(min_elevation))
-        print("     Frequency               : " + str(frequency))
-        print("     Downlink type           : " + downlink)
-        print("     Delete processed files  : " + str(delete_processed_files))
-        
-        satellite = Satellite(
-            name,
-            norad,
-            priority,
-            min_elevation,
-            frequency,
-            downlink,
-            delete_processed_files,
-        )
-        satellites.append(satellite)
 
+    for satellite in satellites:
+        print("Adding " + satellite.verbose_name + " :")
+        print("     NORAD                   : " + str(satellite.norad))
+        print("     Priority                : " + str(satellite.priority))
+        print("     Minimum elevation       : " + str(satellite.min_elevation))
+        print("     Frequency               : " + str(satellite.frequency))
+        print("     Downlink type           : " + satellite.downlink)
+        print("     Delete processed files  : " + str(satellite.delete_processed_files))
+        if satellite.max_size_mb > 0:
+            print("     Maximum size            : " + str(satellite.max_size_mb) + "MB")
     print("\n")
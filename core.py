@@ -1,27 +1,123 @@
-from satellite_tle import fetch_tle
-from orbit_predictor.sources import get_predictor_from_tle_lines
-from apscheduler.schedulers.background import BackgroundScheduler
-from pytz import utc
-from threading import Lock
+from threading import Condition
 import logging
+import os
+import subprocess
 
 logger = logging.getLogger('main.core')
 
 import config
+import metrics
 
-# Main scheduler
-scheduler = BackgroundScheduler()
+# Main scheduler, created by initScheduler
+scheduler = None
 
-# Decoding queue
-decoding_queue = list()
+# Decoding executor, started by initDecoder
+decoder = None
 
-# Radio mutex
-radio_lock = Lock()
+# Radio pool, filled from the configuration by initRadios
+radio_pool = None
+
+# Post-processing hook runner, started by initHooks
+hook_runner = None
+
+# Image publisher, started by initPublisher if enabled
+publisher = None
 
 # Init scheduler
 def initScheduler():
-    scheduler.configure(timezone=utc)
-    scheduler.start()
+    global scheduler
+    from apscheduler.jobstores.memory import MemoryJobStore
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from pytz import utc
+
+    # Jobs only making sense in this run, like the configuration reloader, go
+    # to the memory store
+    jobstores = dict(memory=MemoryJobStore())
+    # Keep the jobs in a database so scheduled passes survive a restart
+    if config.fast_start:
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        jobstores["default"] = SQLAlchemyJobStore(
+            url="sqlite:///" + os.path.join(config.output_dir, "jobs.db")
+        )
+    scheduler = BackgroundScheduler(timezone=utc, jobstores=jobstores)
+
+    # Start paused to drop a reloader stored by an earlier run before any
+    # stored job gets to run
+    scheduler.start(paused=True)
+    if scheduler.get_job("config_reload") is not None:
+        scheduler.remove_job("config_reload")
+    scheduler.resume()
+
+
+# Init decoding workers, handler being called for each queued recording
+def initDecoder(handler):
+    global decoder
+    from decoding import DecodeExecutor
+
+    # Save the queue so pending decodings are resumed after a restart
+    on_change = None
+    if config.fast_start:
+        import snapshot
+        on_change = snapshot.savePending
+
+    decoder = DecodeExecutor(
+        handler,
+        config.decoding_workers,
+        config.decoding_timeout * 60,
+        config.decoding_queue_size,
+        on_change,
+    )
+    decoder.start()
+    metrics.registerGauge("auto137_decoding_queue_depth", decoder.pending)
+
+
+# Init post-processing hook workers
+def initHooks():
+    global hook_runner
+    from hooks import HookRunner
+
+    hook_runner = HookRunner(
+        config.post_processing_hook_command,
+        config.post_processing_hook_foreach,
+        config.post_processing_hook_workers,
+        config.post_processing_hook_queue_size,
+        config.post_processing_hook_timeout,
+        config.post_processing_hook_retries,
+        config.post_processing_hook_retry_delay,
+        config.post_processing_hook_batch_window,
+    )
+    hook_runner.start()
+    metrics.registerGauge("auto137_hook_queue_depth", hook_runner.pending)
+
+
+# Init image publisher, left disabled if its backend can't be set up
+def initPublisher():
+    global publisher
+    from publisher import HTTPBackend, Publisher, TwitterBackend
+
+    try:
+        if config.publisher_backend == "http":
+            backend = HTTPBackend(config.publisher_url, config.publisher_token)
+        else:
+            backend = TwitterBackend()
+    except Exception as ex:
+        logger.error(f"Failed to set up the {config.publisher_backend} publisher: {ex}")
+        return
+    publisher = Publisher(
+        backend,
+        config.publisher_max_size * 1024,
+        config.publisher_queue_size,
+        config.publisher_retries,
+        config.publisher_retry_delay,
+    )
+    publisher.start()
+    metrics.registerGauge("auto137_publishing_queue_depth", publisher.pending)
+
+
+# Init radio pool
+def initRadios():
+    global radio_pool
+    radio_pool = RadioPool(config.radios)
 
 
 # Satellite class
@@ -44,22 +140,79 @@ class Satellite:
         self.frequency = frequency
         self.downlink = downlink
         self.delete_processed_files = delete_processed_files
+        # Space the files of this satellite may take, 0 for no limit
+        self.max_size_mb = 0
+        self.tle_1 = None
+        self.tle_2 = None
+        self.predictor = None
 
-    def fetch_tle(self):
-        logger.info(f'Updating TLE for {self.verbose_name}...')
-        try:
-            tle = fetch_tle.fetch_tle_from_celestrak(self.norad)
-            name, line1, line2 = tle
+    # Use a new element set, the predictor and passes cached for older ones
+    # being stale then
+    def set_tle(self, line1, line2):
+        if (line1, line2) != (self.tle_1, self.tle_2):
             self.tle_1 = line1
             self.tle_2 = line2
-        except ConnectionError as ex:
-            logger.error(f"Failed to fetch the TLE for {self.name} with exception {ex}")
+            self.predictor = None
+            import passcache
+            passcache.prune(self)
+
+    def has_tle(self):
+        return self.tle_1 is not None and self.tle_2 is not None
 
     def get_predictor(self):
-        self.predictor = get_predictor_from_tle_lines((self.tle_1, self.tle_2))
+        if not self.has_tle():
+            raise LookupError(f"No TLE for {self.verbose_name}")
+        if self.predictor is None:
+            from orbit_predictor.sources import get_predictor_from_tle_lines
+            self.predictor = get_predictor_from_tle_lines((self.tle_1, self.tle_2))
         return self.predictor
 
 
+# Radio class, one per rtl_sdr dongle
+class Radio:
+    def __init__(self, index, device, ppm):
+        self.index = index
+        self.device = device
+        self.ppm = ppm
+        self.process = None
+
+    # Stop the receiver running on this radio, if any, and wait for it to exit
+    def stop(self, timeout=5):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+
+# Pool of radios, each recording one pass at a time
+class RadioPool:
+    def __init__(self, radios):
+        self.radios = radios
+        self.busy = set()
+        self.condition = Condition()
+
+    # Take a free radio, preferring the one the pass was planned on
+    def acquire(self, preferred=0):
+        with self.condition:
+            while len(self.busy) == len(self.radios):
+                self.condition.wait()
+            if preferred >= len(self.radios) or preferred in self.busy:
+                preferred = next(
+                    radio.index for radio in self.radios if radio.index not in self.busy
+                )
+            self.busy.add(preferred)
+            return self.radios[preferred]
+
+    def release(self, radio):
+        with self.condition:
+            self.busy.discard(radio.index)
+            self.condition.notify()
+
+
 # Recording class
 class Recording:
     def __init__(self, satellite, filename, date, passobj):
@@ -67,10 +220,12 @@ class Recording:
         self.filename = filename
         self.date = date
         self.passobj = passobj
+        # Timings and sizes reported in the pass summary
+        self.summary = dict()
 
 
 # Update TLE
 def updateTLEs():
-    for satellite in config.satellites:
-        satellite.fetch_tle()
+    import tle
+    tle.refresh(config.satellites)
     logger.info('TLEs updated!')
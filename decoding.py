@@ -0,0 +1,162 @@
+import itertools
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import time
+from queue import PriorityQueue
+from threading import Lock, Thread, local
+
+import config
+import metrics
+
+logger = logging.getLogger("main.decoding")
+
+# Deadline and step reports of the job running on the current worker thread
+current_job = local()
+
+
+# Raised when a decoding runs past its timeout
+class DecodeTimeout(Exception):
+    pass
+
+
+# Pool of decoding threads fed by a bounded priority queue. Decoding is
+# spent in external processes, so threads are enough to use every core.
+class DecodeExecutor:
+    def __init__(self, handler, workers, timeout, queue_size, on_change=None):
+        self.handler = handler
+        self.workers = workers
+        self.timeout = timeout
+        self.queue = PriorityQueue(maxsize=queue_size)
+        self.counter = itertools.count()
+        self.threads = list()
+
+        # Recordings queued or being decoded, given to on_change when they
+        # change so they can be saved
+        self.jobs = dict()
+        self.jobs_lock = Lock()
+        self.on_change = on_change
+
+    def start(self):
+        for i in range(self.workers):
+            thread = Thread(target=self._work, name=f"decoder-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Queue a recording, higher priority satellites first then oldest first.
+    # Blocks while the queue is full so a backlog slows down its producers.
+    def submit(self, recording):
+        if self.queue.full():
+            logger.warning(
+                f"Decoding queue full, waiting to queue {recording.satellite.name}"
+            )
+        count = next(self.counter)
+        self._track(count, recording)
+        self.queue.put((-recording.satellite.priority, count, recording))
+
+    def pending(self):
+        return self.queue.qsize()
+
+    # Let the workers finish the queued recordings, then stop them
+    def shutdown(self):
+        for _ in self.threads:
+            self.queue.put((float("inf"), next(self.counter), None))
+        for thread in self.threads:
+            thread.join()
+        self.threads = list()
+
+    def _track(self, count, recording=None):
+        with self.jobs_lock:
+            if recording is None:
+                self.jobs.pop(count, None)
+            else:
+                self.jobs[count] = recording
+            if self.on_change is not None:
+                try:
+                    self.on_change(list(self.jobs.values()))
+                except Exception:
+                    logger.exception("Failed to save the decoding queue")
+
+    def _work(self):
+        while True:
+            _, count, recording = self.queue.get()
+            if recording is None:
+                self.queue.task_done()
+                return
+            current_job.deadline = time.monotonic() + self.timeout
+            current_job.steps = list()
+            try:
+                self.handler(recording)
+            except DecodeTimeout as ex:
+                logger.error(f"Decoding of '{recording.filename}' aborted: {ex}")
+            except Exception:
+                logger.exception(f"Decoding of '{recording.filename}' failed")
+            finally:
+                current_job.deadline = None
+                current_job.steps = None
+                self._track(count)
+                self.queue.task_done()
+
+
+# Start an external decoding step at a lower priority than the recordings.
+# The priority is lowered by running it through nice, changing it in the
+# forked child being unsafe while other threads may hold locks.
+def spawn(command):
+    if isinstance(command, str):
+        wrapped = ["/bin/sh", "-c", command]
+    else:
+        wrapped = list(command)
+    process = subprocess.Popen(
+        ["nice", "-n", str(config.decoding_niceness)] + wrapped,
+        start_new_session=True,
+    )
+    process.command = command
+    return process
+
+
+# Name of the program run by a process, for the metrics
+def _program(process):
+    args = process.command
+    if isinstance(args, list) and len(args) == 1:
+        args = args[0]
+    if isinstance(args, str):
+        args = shlex.split(args) or [""]
+    return os.path.basename(args[0])
+
+
+# Reap a process like Popen.wait, also getting its resource usage, which
+# includes the children it waited for such as the commands of a shell
+def _reap(process, deadline):
+    delay = 0.0005
+    while True:
+        pid, status, usage = os.wait4(
+            process.pid, 0 if deadline is None else os.WNOHANG
+        )
+        if pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return usage
+        if time.monotonic() >= deadline:
+            raise subprocess.TimeoutExpired(process.args, 0)
+        time.sleep(min(delay, max(0, deadline - time.monotonic())))
+        delay = min(delay * 2, 0.05)
+
+
+# Wait for a step, killing it if the job it belongs to runs out of time
+def wait(process, deadline=None):
+    if deadline is None:
+        deadline = getattr(current_job, "deadline", None)
+    try:
+        usage = _reap(process, deadline)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        usage = _reap(process, None)
+        metrics.observeProcess(_program(process), usage)
+        raise DecodeTimeout(f"{process.command} timed out")
+    metrics.observeProcess(_program(process), usage)
+    return process.returncode
+
+
+def run(command, deadline=None):
+    return wait(spawn(command), deadline)
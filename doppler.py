@@ -0,0 +1,59 @@
+import logging
+
+import numpy as np
+
+import predict
+
+logger = logging.getLogger("main.doppler")
+
+SPEED_OF_LIGHT = 299792.458  # km/s
+
+# Margin around the pass covered by the table, in seconds
+TABLE_MARGIN = 60
+
+
+# Doppler shift in Hz of a carrier over a pass as (seconds since start, shift)
+def dopplerTable(satellite, start, end, frequency_hz, step=1):
+    offsets, ranges = predict.slantRange(satellite, start, end, step=step)
+    range_rate = np.gradient(ranges, offsets)
+    return offsets, -frequency_hz * range_rate / SPEED_OF_LIGHT
+
+
+# Streaming stage shifting interleaved 16 bit IQ samples back by the predicted
+# Doppler shift, so the demodulator sees a steady carrier
+class DopplerCorrector:
+    def __init__(self, satellite, start, end, sample_rate):
+        self.sample_rate = sample_rate
+        self.offsets, self.shifts = dopplerTable(
+            satellite, start, end, satellite.frequency * 1e6
+        )
+        self.samples = 0
+        self.phase = 0.0
+        self.leftover = b""
+        logger.info(
+            f"Doppler table for {satellite.name}: "
+            f"{self.shifts.max():+.0f}Hz to {self.shifts.min():+.0f}Hz"
+        )
+
+    def __call__(self, chunk):
+        # Only process whole IQ pairs, keeping the rest for the next chunk
+        chunk = self.leftover + chunk
+        usable = len(chunk) - len(chunk) % 4
+        self.leftover = chunk[usable:]
+        iq = np.frombuffer(chunk[:usable], dtype=np.int16).astype(np.float32)
+        samples = iq[0::2] + 1j * iq[1::2]
+        count = samples.size
+
+        # Integrate the shift sample by sample to keep the phase continuous
+        times = (self.samples + np.arange(count)) / self.sample_rate
+        shifts = np.interp(times, self.offsets, self.shifts)
+        phases = self.phase - 2 * np.pi * np.cumsum(shifts) / self.sample_rate
+        if count > 0:
+            self.phase = float(phases[-1] % (2 * np.pi))
+        self.samples += count
+        samples *= np.exp(1j * phases).astype(np.complex64)
+
+        corrected = np.empty(count * 2, dtype=np.int16)
+        corrected[0::2] = np.clip(np.rint(samples.real), -32768, 32767)
+        corrected[1::2] = np.clip(np.rint(samples.imag), -32768, 32767)
+        return corrected.tobytes()
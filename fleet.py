@@ -0,0 +1,302 @@
+import argparse
+import http.server
+import json
+import logging
+import socket
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+
+import config
+import metrics
+import planner
+
+logger = logging.getLogger("main.fleet")
+
+# Passes of a satellite culminating this close to each other for different
+# stations are the same pass
+SAME_PASS = timedelta(minutes=10)
+
+# Stations not heard from for this long are left out, their passes going to
+# the others
+STATION_TIMEOUT = timedelta(hours=3)
+
+# Passes starting this soon have already been scheduled by their station, so
+# they stay assigned to it
+COMMITTED = timedelta(hours=1)
+
+
+# A pass as seen by one station of the fleet
+class StationPass:
+    def __init__(self, station, entry):
+        self.station = station
+        self.norad = int(entry["norad"])
+        self.satellite = entry.get("satellite", str(self.norad))
+        self.priority = int(entry.get("priority", 0))
+        self.key = entry["aos"]
+        self.aos = datetime.fromisoformat(entry["aos"])
+        self.tca = datetime.fromisoformat(entry["tca"])
+        self.los = datetime.fromisoformat(entry["los"])
+        self.max_elevation = float(entry["max_elevation"])
+
+    # Identifies the pass of a station across assignments
+    @property
+    def id(self):
+        return (self.station, self.norad, self.key)
+
+
+# Latest passes submitted by a station
+class Station:
+    def __init__(self, name, radios, maximum_overlap, passes):
+        self.name = name
+        self.radios = radios
+        self.maximum_overlap = timedelta(minutes=maximum_overlap)
+        self.passes = passes
+        self.seen = datetime.utcnow()
+
+
+# Whether a station still has a radio free for a pass, passes being allowed to
+# lose up to maximum_overlap of their end to the next one like in the planner
+def _fits(schedule, candidate, station):
+    start, end = candidate.aos, candidate.los - station.maximum_overlap
+    events = list()
+    for other in schedule:
+        other_end = other.los - station.maximum_overlap
+        if other.aos < end and start < other_end:
+            events.append((max(other.aos, start), 1))
+            events.append((min(other_end, end), -1))
+
+    busy = 0
+    for _, change in sorted(events):
+        busy += change
+        if busy >= station.radios:
+            return False
+    return True
+
+
+# Passes of all stations grouped by the actual pass they are views of
+def _group(passes):
+    groups = list()
+    for stationpass in sorted(passes, key=lambda p: (p.norad, p.tca)):
+        group = groups[-1] if groups else None
+        if (
+            group is None
+            or group[0].norad != stationpass.norad
+            or stationpass.tca - group[0].tca > SAME_PASS
+        ):
+            groups.append([stationpass])
+        else:
+            group.append(stationpass)
+    return groups
+
+
+# Value of a pass to the fleet, as the planner would weight it
+def _value(group):
+    best = max(stationpass.max_elevation for stationpass in group)
+    return planner.PRIORITY_WEIGHT * (1 + group[0].priority) + best
+
+
+# Collects the passes predicted by every station and gives each pass to the
+# station seeing it highest that has a radio free for it
+class Coordinator:
+    def __init__(self):
+        self.stations = dict()
+        self.committed = dict()
+        self.schedules = dict()
+        self.dropped = 0
+        self.lock = Lock()
+
+    # Take the passes of a station, returning those it should record
+    def update(self, station):
+        with self.lock:
+            self.stations[station.name] = station
+            self._assign()
+            return self.schedules.get(station.name, list())
+
+    def _assign(self, now=None):
+        if now is None:
+            now = datetime.utcnow()
+        for name, station in list(self.stations.items()):
+            if now - station.seen > STATION_TIMEOUT:
+                logger.warning(f"Station {name} went silent, reassigning its passes")
+                del self.stations[name]
+        self.committed = {
+            key: stationpass
+            for key, stationpass in self.committed.items()
+            if stationpass.los > now and stationpass.station in self.stations
+        }
+
+        passes = [p for station in self.stations.values() for p in station.passes]
+        schedules = {name: list() for name in self.stations}
+        groups = _group(passes)
+        pending = list()
+        for group in groups:
+            committed = [p for p in group if p.id in self.committed]
+            if committed:
+                schedules[committed[0].station].append(committed[0])
+            else:
+                pending.append(group)
+
+        # Most valuable passes first, each to the best placed station able to
+        # take it
+        dropped = 0
+        pending.sort(key=lambda group: (-_value(group), group[0].tca))
+        for group in pending:
+            for candidate in sorted(group, key=lambda p: -p.max_elevation):
+                station = self.stations[candidate.station]
+                if _fits(schedules[station.name], candidate, station):
+                    schedules[station.name].append(candidate)
+                    if candidate.aos < now + COMMITTED:
+                        self.committed[candidate.id] = candidate
+                    break
+            else:
+                dropped += 1
+
+        for schedule in schedules.values():
+            schedule.sort(key=lambda stationpass: stationpass.aos)
+        self.schedules = schedules
+        self.dropped = dropped
+        logger.info(
+            f"Assigned {sum(len(s) for s in schedules.values())} of "
+            f"{len(groups)} passes to "
+            f"{len(self.stations)} station(s), {len(passes)} predicted"
+        )
+
+    def summary(self):
+        with self.lock:
+            return {
+                "stations": {
+                    name: {
+                        "seen": self.stations[name].seen.isoformat(),
+                        "radios": self.stations[name].radios,
+                        "predicted": len(self.stations[name].passes),
+                        "assigned": [_entry(p) for p in schedule],
+                    }
+                    for name, schedule in self.schedules.items()
+                },
+                "dropped": self.dropped,
+            }
+
+
+def _entry(stationpass):
+    return {
+        "norad": stationpass.norad,
+        "satellite": stationpass.satellite,
+        "aos": stationpass.key,
+        "los": stationpass.los.isoformat(),
+        "max_elevation": stationpass.max_elevation,
+    }
+
+
+# Receives the passes of the stations and answers with their schedule
+class CoordinatorHandler(http.server.BaseHTTPRequestHandler):
+    coordinator = None
+
+    def _reply(self, status, document):
+        body = json.dumps(document).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/schedule":
+            self.send_error(404, "Not found")
+            return
+        self._reply(200, self.coordinator.summary())
+
+    def do_POST(self):
+        if self.path.split("?")[0] != "/schedule":
+            self.send_error(404, "Not found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            document = json.loads(self.rfile.read(length))
+            name = str(document["station"])
+            station = Station(
+                name,
+                int(document.get("radios", 1)),
+                int(document.get("maximum_overlap", 0)),
+                [StationPass(name, entry) for entry in document["passes"]],
+            )
+        except (KeyError, TypeError, ValueError) as ex:
+            self._reply(400, {"error": str(ex)})
+            return
+        schedule = self.coordinator.update(station)
+        self._reply(200, {"assigned": [_entry(p) for p in schedule]})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+# Run a coordinator in the background
+def startCoordinator(port):
+    import webserver
+
+    handler = type("Handler", (CoordinatorHandler,), {"coordinator": Coordinator()})
+    httpd = webserver.OutputServer(("", port), handler)
+    Thread(target=httpd.serve_forever, name="fleet", daemon=True).start()
+    return httpd
+
+
+def stationName():
+    return config.fleet_station or socket.gethostname()
+
+
+# Keep the passes the fleet coordinator gives this station, or all of them
+# when it can't be reached so the station keeps working alone
+def assigned(passes):
+    document = {
+        "station": stationName(),
+        "radios": len(config.radios),
+        "maximum_overlap": config.maximum_overlap,
+        "passes": [
+            {
+                "norad": passobj.satellite.norad,
+                "satellite": passobj.satellite.verbose_name,
+                "priority": passobj.satellite.priority,
+                "aos": passobj.aos.isoformat(),
+                "tca": passobj.tca.isoformat(),
+                "los": passobj.los.isoformat(),
+                "max_elevation": passobj.max_elevation_deg,
+            }
+            for passobj in passes
+        ],
+    }
+    request = urllib.request.Request(
+        config.fleet_url,
+        json.dumps(document).encode("utf-8"),
+        {"Content-Type": "application/json", "User-Agent": "Auto137"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=config.fleet_timeout) as response:
+            schedule = json.loads(response.read())["assigned"]
+    except (OSError, ValueError, KeyError) as ex:
+        logger.warning(f"Fleet coordinator unreachable, planning alone: {ex}")
+        metrics.increment("auto137_fleet_updates_total", outcome="failed")
+        return passes
+
+    keys = set((entry["norad"], entry["aos"]) for entry in schedule)
+    kept = [p for p in passes if (p.satellite.norad, p.aos.isoformat()) in keys]
+    logger.info(
+        f"Fleet coordinator assigned {len(kept)} of {len(passes)} passes "
+        f"to {stationName()}"
+    )
+    metrics.increment("auto137_fleet_updates_total", outcome="done")
+    metrics.setGauge("auto137_fleet_assigned_passes", len(kept))
+    return kept
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s : %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Coordinate a fleet of stations")
+    parser.add_argument("--port", type=int, default=9138)
+    args = parser.parse_args()
+    startCoordinator(args.port)
+    logger.info(f"Fleet coordinator listening on port {args.port}")
+    while True:
+        time.sleep(10)
@@ -0,0 +1,121 @@
+import logging
+import time
+from queue import Empty, Full, Queue
+from threading import Thread, Timer
+
+import decoding
+import metrics
+
+logger = logging.getLogger("main.hooks")
+
+
+# An invocation of the hook, on one or several output files
+class HookJob:
+    def __init__(self, files, attempt=0):
+        self.files = files
+        self.attempt = attempt
+
+
+# Runs the post-processing hook on its own workers so slow hooks, like
+# uploads, never hold back the decoding. Failed runs are retried later, and
+# files queued within batch_window seconds can be handed to a single run.
+class HookRunner:
+    def __init__(
+        self,
+        command,
+        foreach,
+        workers,
+        queue_size,
+        timeout,
+        retries,
+        retry_delay,
+        batch_window,
+    ):
+        self.command = command
+        self.foreach = foreach
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.batch_window = 0 if foreach else batch_window
+        self.queue = Queue(maxsize=queue_size)
+        self.threads = list()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = Thread(target=self._work, name=f"hook-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Queue the outputs of a pass, dropping them rather than waiting if the
+    # hook is too far behind
+    def submit(self, files):
+        jobs = [HookJob([file]) for file in files] if self.foreach else [HookJob(files)]
+        for job in jobs:
+            self._put(job)
+
+    def _put(self, job):
+        try:
+            self.queue.put_nowait(job)
+        except Full:
+            logger.error(f"Hook queue full, dropping {job.files}")
+            metrics.increment("auto137_hook_runs_total", outcome="dropped")
+
+    def pending(self):
+        return self.queue.qsize()
+
+    # Take a job, merged with those arriving in the batch window
+    def _next(self):
+        job = self.queue.get()
+        if self.batch_window <= 0 or job.attempt > 0:
+            return job, 1
+
+        count = 1
+        files = list(job.files)
+        end = time.monotonic() + self.batch_window
+        while time.monotonic() < end:
+            try:
+                other = self.queue.get(timeout=end - time.monotonic())
+            except Empty:
+                break
+            files += other.files
+            count += 1
+        return HookJob(files), count
+
+    def _work(self):
+        while True:
+            job, count = self._next()
+            try:
+                self._run(job)
+            except Exception:
+                logger.exception(f"Hook failed on {job.files}")
+            finally:
+                for _ in range(count):
+                    self.queue.task_done()
+
+    def _run(self, job):
+        command = self.command.replace(
+            "{file}", " ".join(f"'{file}'" for file in job.files)
+        )
+        try:
+            with metrics.timed("post_processing_hook"):
+                returncode = decoding.run(command, time.monotonic() + self.timeout)
+        except decoding.DecodeTimeout:
+            returncode = None
+
+        if returncode == 0:
+            metrics.increment("auto137_hook_runs_total", outcome="done")
+            return
+        reason = "timed out" if returncode is None else f"exited with {returncode}"
+        if job.attempt >= self.retries:
+            logger.error(f"Hook {reason} on {job.files}, giving up")
+            metrics.increment("auto137_hook_runs_total", outcome="failed")
+            return
+
+        # Retry later without holding a worker, waiting longer each time
+        delay = self.retry_delay * 2**job.attempt
+        logger.warning(f"Hook {reason} on {job.files}, retrying in {delay}s")
+        metrics.increment("auto137_hook_runs_total", outcome="retried")
+        timer = Timer(delay, self._put, [HookJob(job.files, job.attempt + 1)])
+        timer.daemon = True
+        timer.start()
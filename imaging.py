@@ -0,0 +1,71 @@
+import logging
+import math
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+
+import config
+
+logger = logging.getLogger("main.imaging")
+
+# MSU-MR scanner geometry, in km
+EARTH_RADIUS = 6371.0
+SATELLITE_ALTITUDE = 830.0
+SWATH = 2800.0
+
+
+# Source column sampled by each column of the corrected image. The scanner
+# samples at a constant angular step, so pixels get wider on the ground away
+# from nadir. Output columns are evenly spaced on the ground instead, keeping
+# the nadir resolution.
+@lru_cache(maxsize=8)
+def _correctionMap(width):
+    radius, altitude = EARTH_RADIUS, SATELLITE_ALTITUDE
+    half_angle = SWATH / 2 / radius
+    max_scan = math.atan(
+        radius
+        * math.sin(half_angle)
+        / (radius + altitude - radius * math.cos(half_angle))
+    )
+    scan_step = 2 * max_scan / width
+
+    # Ground distance covered by one pixel at nadir
+    output_width = int(round(SWATH / (altitude * scan_step)))
+    ground = (np.arange(output_width) + 0.5) / output_width * SWATH - SWATH / 2
+    theta = ground / radius
+    scan = np.arctan2(
+        radius * np.sin(theta), radius + altitude - radius * np.cos(theta)
+    )
+    source = np.clip((scan + max_scan) / scan_step - 0.5, 0, width - 1)
+
+    left = np.floor(source).astype(np.intp)
+    right = np.minimum(left + 1, width - 1)
+    weight = (source - left).astype(np.float32)
+    return left, right, weight
+
+
+# Stretch the edges of a MSU-MR image to undo the Earth curvature
+def correctGeometry(pixels):
+    left, right, weight = _correctionMap(pixels.shape[1])
+    weight = weight.reshape((1, -1) + (1,) * (pixels.ndim - 2))
+    data = pixels.astype(np.float32)
+    corrected = data[:, left] * (1 - weight) + data[:, right] * weight
+    return np.rint(corrected).astype(np.uint8)
+
+
+# Read a medet bitmap once and write its PNG, corrected if enabled
+def convertBitmap(output):
+    with Image.open(output + ".bmp") as image:
+        pixels = np.asarray(image.convert("RGB"))
+
+    if config.imaging_keep_uncorrected:
+        Image.fromarray(pixels).save(
+            output + "-raw.png", compress_level=config.imaging_compression
+        )
+    if config.imaging_correct_geometry:
+        pixels = correctGeometry(pixels)
+    Image.fromarray(pixels).save(
+        output + ".png", compress_level=config.imaging_compression
+    )
+    logger.info(f"Converted '{output}.bmp' to {pixels.shape[1]}x{pixels.shape[0]} PNG")
@@ -1,12 +1,22 @@
+import time
+
+# Startup is timed from here, the imports below being part of it
+STARTED = time.monotonic()
+
 import logging
 import os
-import time
+from datetime import datetime
 from pathlib import Path
-from threading import Thread
+
+from pytz import utc
 
 import config
 import core
+import metrics
 import passutils
+import snapshot
+import storage
+import tle
 
 
 def main():
@@ -19,10 +29,24 @@ def main():
     fh.setFormatter(formatter)
     logger.addHandler(fh)
 
-    # Parse config, fetch some data
-    config.loadConfig("config.yaml")
+    # Time taken by each step of the startup, reported once running
+    startup = [("imports", time.monotonic() - STARTED)]
+    last = time.monotonic()
+
+    def mark(step):
+        nonlocal last
+        now = time.monotonic()
+        startup.append((step, now - last))
+        last = now
+
+    # Parse config
+    try:
+        config.loadConfig("config.yaml")
+    except config.ConfigError as ex:
+        logger.error(str(ex))
+        raise SystemExit(str(ex))
+    config.printConfig()
     logger.info('Configuration loaded/')
-    core.updateTLEs()
 
     # Create images folders
     for satellite in config.satellites:
@@ -30,27 +54,97 @@ def main():
             os.makedirs(config.output_dir + "/" + satellite.name)
             logger.info('Data directories structure created.')
 
-    # Init sheduler and start repeating tasks
+    mark("config")
+
+    # Fetch TLEs, unless the cached ones allow starting right away
+    tle_refresh = dict()
+    if config.fast_start and tle.applyCached(config.satellites):
+        tle_refresh["next_run_time"] = datetime.now(utc)
+        logger.info('Starting from cached TLEs, refreshing them in the background')
+    else:
+        core.updateTLEs()
+    mark("tle")
+
+    # Init radios, sheduler and start repeating tasks
+    core.initRadios()
     core.initScheduler()
     core.scheduler.add_job(
-        core.updateTLEs, "interval", id="tle_refresh", hours=config.tle_update_interval
+        core.updateTLEs,
+        "interval",
+        id="tle_refresh",
+        hours=config.tle_update_interval,
+        replace_existing=True,
+        **tle_refresh,
+    )
+    core.scheduler.add_job(
+        passutils.updatePass,
+        "interval",
+        id="passes_refresh",
+        hours=1,
+        replace_existing=True,
+    )
+    core.scheduler.add_job(
+        storage.enforce,
+        "interval",
+        id="storage_retention",
+        hours=1,
+        next_run_time=datetime.now(utc),
+        replace_existing=True,
     )
-    core.scheduler.add_job(passutils.updatePass, "interval", id="passes_refresh", hours=1)
     logger.info("Scheduler started!")
 
-    # Start decoding thread
-    decodingThread = Thread(target=passutils.processDecodeQueue)
-    decodingThread.start()
-    logger.info("Decoding thread started!")
-    
+    # Apply changes of config.yaml without restarting
+    if config.hot_reload:
+        import reloader
+        reloader.start()
+    mark("scheduler")
+
+    # Start decoding threads, resuming the decodings left by the previous run
+    core.initDecoder(passutils.decodeRecording)
+    logger.info(f"{config.decoding_workers} decoding thread(s) started!")
+    if config.fast_start:
+        for recording in snapshot.loadPending():
+            logger.info(f"Resuming decoding of '{recording.filename}'")
+            core.decoder.submit(recording)
+    mark("decoder")
+
+    # Start post-processing hook workers if enabled
+    if config.post_processing_hook_enabled:
+        core.initHooks()
+
+    # Start image publisher if enabled
+    if config.publisher_enabled:
+        core.initPublisher()
+
+    # Start metrics endpoint if enabled
+    if config.metrics_enabled:
+        import webserver
+        webserver.startMetricsServer(config.metrics_port)
+        logger.info(f"Metrics served on port {config.metrics_port}")
+
+    # Start the fleet coordinator if this station hosts it
+    if config.fleet_coordinator:
+        import fleet
+        fleet.startCoordinator(config.fleet_port)
+        logger.info(f"Fleet coordinator listening on port {config.fleet_port}")
+
     # Start RSS Server if enabled
     if config.rss_enabled:
         import rss
         rss.startServer()
-    
+    mark("services")
+
     # Schedule passes
     passutils.updatePass()
-    
+    mark("planning")
+
+    # Report where the startup time went
+    for step, seconds in startup:
+        metrics.setGauge("auto137_startup_seconds", seconds, step=step)
+    report = ", ".join(f"{step} {seconds:.2f}s" for step, seconds in startup)
+    logger.info(f"Started in {time.monotonic() - STARTED:.2f}s ({report})")
+    print(f"Started in {time.monotonic() - STARTED:.2f}s ({report})")
+
     # Wait forever
     while True:
         time.sleep(10)
@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+logger = logging.getLogger("main.metrics")
+
+# Metric values keyed by (name, labels), guarded by a single mutex
+counters = dict()
+gauges = dict()
+callbacks = dict()
+metrics_lock = Lock()
+
+HELP = {
+    "auto137_stage_seconds_total": ("counter", "Time spent in each stage"),
+    "auto137_stage_runs_total": ("counter", "Number of runs of each stage"),
+    "auto137_stage_last_seconds": ("gauge", "Duration of the last run of each stage"),
+    "auto137_process_cpu_seconds_total": (
+        "counter",
+        "CPU time used by external processes",
+    ),
+    "auto137_process_max_rss_bytes": (
+        "gauge",
+        "Peak resident memory of the last run of external processes",
+    ),
+    "auto137_recorded_bytes_total": ("counter", "Bytes written by recordings"),
+    "auto137_startup_seconds": ("gauge", "Time taken by each step of the startup"),
+    "auto137_fleet_updates_total": (
+        "counter",
+        "Schedules asked to the fleet coordinator by outcome",
+    ),
+    "auto137_fleet_assigned_passes": (
+        "gauge",
+        "Passes the fleet coordinator gave this station",
+    ),
+    "auto137_capture_stalls_total": (
+        "counter",
+        "Times a capture waited for the disk to catch up",
+    ),
+    "auto137_capture_missing_bytes_total": (
+        "counter",
+        "Estimated IQ bytes lost by captures",
+    ),
+    "auto137_passes_total": ("counter", "Passes by outcome"),
+    "auto137_decoding_queue_depth": ("gauge", "Recordings waiting to be decoded"),
+    "auto137_planned_passes": ("gauge", "Passes in the current plan"),
+    "auto137_hook_runs_total": ("counter", "Post-processing hook runs by outcome"),
+    "auto137_hook_queue_depth": ("gauge", "Post-processing hook runs waiting"),
+    "auto137_published_total": ("counter", "Published images by outcome"),
+    "auto137_publishing_queue_depth": ("gauge", "Images waiting to be published"),
+    "auto137_storage_bytes": ("gauge", "Size of the files kept for the passes"),
+    "auto137_storage_free_bytes": ("gauge", "Free space left in the output directory"),
+}
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def increment(name, value=1, **labels):
+    with metrics_lock:
+        key = _key(name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+
+def setGauge(name, value, **labels):
+    with metrics_lock:
+        gauges[_key(name, labels)] = value
+
+
+# Gauge evaluated when the metrics are read, like a queue depth
+def registerGauge(name, function):
+    with metrics_lock:
+        callbacks[name] = function
+
+
+def observe(stage, seconds, **labels):
+    increment("auto137_stage_seconds_total", seconds, stage=stage, **labels)
+    increment("auto137_stage_runs_total", 1, stage=stage, **labels)
+    setGauge("auto137_stage_last_seconds", seconds, stage=stage, **labels)
+
+
+# Time the enclosed block as a run of stage
+@contextmanager
+def timed(stage, **labels):
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        observe(stage, time.monotonic() - start, **labels)
+
+
+# Account the resources used by an external process once it exited
+def observeProcess(program, usage):
+    increment(
+        "auto137_process_cpu_seconds_total",
+        usage.ru_utime + usage.ru_stime,
+        program=program,
+    )
+    # ru_maxrss is in kilobytes on Linux
+    setGauge("auto137_process_max_rss_bytes", usage.ru_maxrss * 1024, program=program)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+# Metrics in the Prometheus text exposition format
+def render():
+    with metrics_lock:
+        samples = list(counters.items()) + list(gauges.items())
+        functions = list(callbacks.items())
+    for name, function in functions:
+        try:
+            samples.append(((name, ()), function()))
+        except Exception:
+            logger.exception(f"Failed to evaluate {name}")
+
+    lines = list()
+    described = set()
+    for (name, labels), value in sorted(samples, key=lambda sample: sample[0]):
+        if name not in described and name in HELP:
+            kind, text = HELP[name]
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            described.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Write the summary of a pass next to its output files
+def writePassSummary(filename, summary):
+    temp_path = filename + ".json.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=1, default=str)
+    os.replace(temp_path, filename + ".json")
@@ -0,0 +1,197 @@
+import logging
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from threading import Lock
+
+import numpy as np
+
+import config
+import predict
+from predict import Pass
+
+logger = logging.getLogger("main.passcache")
+
+# Extra days predicted on a miss so the following hourly updates hit the cache
+CACHE_SLACK = 1
+
+# Database connection and its mutex, opened on first use
+connection = None
+cache_lock = Lock()
+
+
+def _connect():
+    global connection
+
+    if connection is None:
+        connection = sqlite3.connect(
+            os.path.join(config.output_dir, "passes.db"), check_same_thread=False
+        )
+        connection.executescript("""
+            CREATE TABLE IF NOT EXISTS predictions (
+                norad INTEGER, tle TEXT, station TEXT, min_elevation REAL,
+                start TEXT, end TEXT,
+                PRIMARY KEY (norad, tle, station, min_elevation)
+            );
+            CREATE TABLE IF NOT EXISTS passes (
+                norad INTEGER, tle TEXT, station TEXT, min_elevation REAL,
+                aos TEXT, tca TEXT, los TEXT, max_elevation REAL, track BLOB
+            );
+            CREATE INDEX IF NOT EXISTS passes_key
+                ON passes (norad, tle, station, min_elevation, aos);
+            """)
+    return connection
+
+
+# Cache key of a satellite's current elements seen from the station
+def _key(satellite):
+    location = config.location
+    station = (
+        f"{location.latitude_deg:.6f},{location.longitude_deg:.6f},"
+        f"{location.elevation_m:.1f}"
+    )
+    return (
+        satellite.norad,
+        satellite.tle_1 + "\n" + satellite.tle_2,
+        station,
+        float(satellite.min_elevation),
+    )
+
+
+def _isCovered(db, satellite, start, end):
+    row = db.execute(
+        "SELECT start, end FROM predictions WHERE norad = ? AND tle = ? "
+        "AND station = ? AND min_elevation = ?",
+        _key(satellite),
+    ).fetchone()
+    return row is not None and row[0] <= start.isoformat() and row[1] >= end.isoformat()
+
+
+def _store(db, satellite, passes, start, end):
+    key = _key(satellite)
+    db.execute(
+        "DELETE FROM passes WHERE norad = ? AND tle = ? AND station = ? "
+        "AND min_elevation = ?",
+        key,
+    )
+    db.execute(
+        "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+        key + (start.isoformat(), end.isoformat()),
+    )
+    db.executemany(
+        "INSERT INTO passes VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+        [
+            key
+            + (
+                next_pass.aos.isoformat(),
+                next_pass.tca.isoformat(),
+                next_pass.los.isoformat(),
+                next_pass.max_elevation_deg,
+            )
+            for next_pass in passes
+        ],
+    )
+
+
+def _load(db, satellite, start, end):
+    rows = db.execute(
+        "SELECT aos, tca, los, max_elevation FROM passes WHERE norad = ? "
+        "AND tle = ? AND station = ? AND min_elevation = ? AND los > ? AND aos < ?",
+        _key(satellite) + (start.isoformat(), end.isoformat()),
+    )
+    return [
+        Pass(
+            satellite,
+            datetime.fromisoformat(aos),
+            datetime.fromisoformat(tca),
+            datetime.fromisoformat(los),
+            max_elevation,
+        )
+        for aos, tca, los, max_elevation in rows
+    ]
+
+
+# Passes of the satellites over the horizon, only predicting those not cached yet
+def getPasses(satellites, start=None, days=None):
+    if start is None:
+        start = datetime.utcnow()
+    if days is None:
+        days = config.prediction_horizon
+    end = start + timedelta(days=days)
+
+    with cache_lock:
+        db = _connect()
+        missing = [
+            satellite
+            for satellite in satellites
+            if not _isCovered(db, satellite, start, end)
+        ]
+
+        # Predict every stale satellite together, a bit further than needed
+        if len(missing) > 0:
+            logger.info(f"Pass cache miss for {len(missing)} satellite(s)")
+            predicted = predict.predictPasses(
+                missing, start=start, days=days + CACHE_SLACK
+            )
+            with db:
+                for satellite in missing:
+                    _store(
+                        db,
+                        satellite,
+                        [p for p in predicted if p.satellite is satellite],
+                        start,
+                        end + timedelta(days=CACHE_SLACK),
+                    )
+
+        passes = list()
+        for satellite in satellites:
+            passes += _load(db, satellite, start, end)
+
+    passes.sort()
+    return passes
+
+
+# Ground track of a pass, computed once then served from the cache
+def getGroundTrack(passobj):
+    satellite = passobj.satellite
+    where = (
+        "WHERE norad = ? AND tle = ? AND station = ? AND min_elevation = ? AND aos = ?"
+    )
+    key = _key(satellite) + (passobj.aos.isoformat(),)
+
+    with cache_lock:
+        db = _connect()
+        row = db.execute("SELECT track FROM passes " + where, key).fetchone()
+        if row is not None and row[0] is not None:
+            return np.frombuffer(row[0], dtype=np.float64).reshape(-1, 3)
+
+        track = predict.groundTrack(satellite, passobj.aos, passobj.los)
+        with db:
+            db.execute("UPDATE passes SET track = ? " + where, (track.tobytes(),) + key)
+    return track
+
+
+# Whether the pass goes South to North
+def isAscending(passobj):
+    track = getGroundTrack(passobj)
+    return track[1, 1] > track[0, 1]
+
+
+# Drop what was predicted for a satellite from other elements than its current
+# ones, used when its TLE changes. Passes of the current elements are kept, so
+# the cache survives restarts.
+def prune(satellite):
+    tle = satellite.tle_1 + "\n" + satellite.tle_2
+    with cache_lock:
+        db = _connect()
+        with db:
+            deleted = db.execute(
+                "DELETE FROM passes WHERE norad = ? AND tle != ?",
+                (satellite.norad, tle),
+            ).rowcount
+            deleted += db.execute(
+                "DELETE FROM predictions WHERE norad = ? AND tle != ?",
+                (satellite.norad, tle),
+            ).rowcount
+    if deleted:
+        logger.info(f"Pass cache pruned of old TLEs for {satellite.verbose_name}")
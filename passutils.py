@@ -4,110 +4,135 @@ import os
 import subprocess
 import time
 from datetime import datetime, timedelta
-
-import ephem
+from functools import partial
 
 import config
 import core
+import decoding
+import metrics
+import passcache
+import planner
+import storage
+import streaming
 from core import Recording, Satellite
+from pipeline import Pipeline, Step
+from predict import Pass
 
 logger = logging.getLogger("main.passutils")
 
+# Seconds given to a process to exit once its input ended
+EXIT_TIMEOUT = 30
+
+# LRPT images produced by medet with their channel mapping
+LRPT_CHANNELS = {"Visible": "-r 65 -g 65 -b 64", "Infrared": "-r 68 -g 68 -b 68"}
+
+# Latest plan computed by updatePass
+plan = None
+
+
+# Scheduler job of a pass, the same when the pass is scheduled again
+def passJobId(norad, aos):
+    return f"pass-{norad}-{aos:%Y%m%d%H%M%S}"
+
 
 # Schedule a pass job
-def schedulePass(pass_to_add, satellite, custom_aos=0, custom_los=0):
+def schedulePass(pass_to_add, satellite, custom_aos=0, custom_los=0, radio=0):
     # Allow setting custom aos/los
     if custom_aos == 0:
         custom_aos = pass_to_add.aos
     if custom_los == 0:
         custom_los = pass_to_add.los
 
-    # Schedule the task
+    # Compute the ground track now rather than when the pass gets decoded
+    passcache.getGroundTrack(pass_to_add)
+
+    # Schedule the task, with plain arguments so it can be kept in the job
+    # store. A pass missed by a restart is still recorded until its LOS.
     core.scheduler.add_job(
-        recordPass, "date", [satellite, custom_los, pass_to_add], run_date=custom_aos
+        recordScheduledPass,
+        "date",
+        [
+            satellite.norad,
+            pass_to_add.aos,
+            pass_to_add.tca,
+            pass_to_add.los,
+            pass_to_add.max_elevation_deg,
+            custom_los,
+            radio,
+        ],
+        id=passJobId(satellite.norad, pass_to_add.aos),
+        replace_existing=True,
+        run_date=custom_aos,
+        misfire_grace_time=max(1, int((custom_los - custom_aos).total_seconds())),
     )
     logger.info(
         f"Scheduled {satellite.name} pass at {str(custom_aos)} "
-        f"with max elevation of {pass_to_add.max_elevation_deg}"
+        f"with max elevation of {pass_to_add.max_elevation_deg} on radio {radio}"
     )
 
 
 # Schedule passes and resolve conflicts
 def updatePass():
-    passes = list()
+    global plan
     timenow = datetime.utcnow()
 
-    # Lookup next passes of all satellites
-    for satellite in config.satellites:
-        predictor = satellite.get_predictor()
-        next_pass = predictor.get_next_pass(
-            config.location, max_elevation_gt=satellite.min_elevation
-        )
-        max_elevation = next_pass.max_elevation_deg
-        priority = satellite.priority
-
-        # Filter those coming in the next hour
-        if next_pass.aos < timenow + timedelta(hours=1):
-            passes.append([next_pass, satellite, max_elevation, priority])
-
-    # Solve conflicts, a conflict being 2 satellites over horizon at the same time
-    for current_pass in passes:
-        current_pass_obj = current_pass[0]
-        current_sat_obj = current_pass[1]
-        current_max_ele = current_pass[2]
-        current_priority = current_pass[3]
-
-        keep = True
-        keep_modified = False
-        custom_aos = 0
-        custom_los = 0
-        for next_pass, satellite, max_elevation, priority in passes:
-            # Skip if this is the same
-            if next_pass == current_pass_obj:
-                continue
-
-            # Test if those 2 conflicts
-            if (
-                next_pass.aos <= current_pass_obj.los
-                and not next_pass.los <= current_pass_obj.aos
-            ):
-                # If the priority is the same, chose the best pass
-                if current_priority == priority:
-                    if current_max_ele < max_elevation:
-                        keep = False
-
-                        # Schedule the pass if it doesn't overlap too much
-                        overlapping_time = current_pass_obj.los - next_pass.aos
-                        if overlapping_time < timedelta(minutes=config.maximum_overlap):
-                            keep_modified = True
-                            custom_aos = current_pass_obj.aos
-                            custom_los = next_pass.aos
-                else:
-                    # Always prefer higher priorities
-                    if current_priority < priority:
-                        keep = False
-
-                        # Schedule the pass if it doesn't overlap too much
-                        overlapping_time = current_pass_obj.los - next_pass.aos
-                        if overlapping_time < timedelta(minutes=config.maximum_overlap):
-                            keep_modified = True
-                            custom_aos = current_pass_obj.aos
-                            custom_los = next_pass.aos
-
-        # Schedule the task
-        if keep:
-            schedulePass(current_pass_obj, current_sat_obj)
-        elif keep_modified:
+    # Lookup passes of all satellites over the horizon, predicting only stale ones
+    # Satellites without any TLE yet can't be predicted
+    satellites = [satellite for satellite in config.satellites if satellite.has_tle()]
+    with metrics.timed("prediction"):
+        passes = passcache.getPasses(satellites)
+
+    # Leave the passes other stations of the fleet are better placed for
+    if config.fleet_enabled:
+        import fleet
+
+        with metrics.timed("fleet"):
+            passes = fleet.assigned(passes)
+
+    # Solve conflicts over the whole horizon, a conflict being 2 satellites over horizon at the same time
+    with metrics.timed("planning"):
+        plan = planner.planPasses(passes)
+    metrics.setGauge("auto137_planned_passes", len(plan.planned))
+
+    # Schedule those coming in the next hour
+    for planned in plan.planned:
+        if timenow <= planned.aos < timenow + timedelta(hours=1):
             schedulePass(
-                current_pass_obj,
-                current_sat_obj,
-                custom_aos=custom_aos,
-                custom_los=custom_los,
+                planned.passobj,
+                planned.satellite,
+                custom_aos=planned.aos,
+                custom_los=planned.los,
+                radio=planned.radio,
             )
+    for line in plan.report(timenow, timenow + timedelta(hours=1)):
+        logger.info(line)
+
+
+# Block until LOS, returning early if the receiver dies
+def waitForLOS(radio, end_time):
+    remaining = (end_time - datetime.utcnow()).total_seconds()
+    try:
+        radio.process.wait(timeout=max(0, remaining))
+    except subprocess.TimeoutExpired:
+        return
+    logger.error(
+        f"Receiver on radio {radio.device} exited before LOS "
+        f"with code {radio.process.returncode}"
+    )
+
+
+# Wait for a process to finish on its own, killing it if it hangs
+def waitForExit(process, timeout=EXIT_TIMEOUT):
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.error(f"{process.args[0]} did not exit, killing it")
+        process.kill()
+        process.wait()
 
 
 # APT Pass record function
-def recordAPT(satellite, end_time):
+def recordAPT(satellite, end_time, radio, passobj, release):
     logger.info(f"AOS {satellite.name}...")
     date = datetime.utcnow()
 
@@ -122,32 +147,83 @@ def recordAPT(satellite, end_time):
         + datetime.utcnow().strftime("%Y%m%d-%H%M%S")
     )
     logger.info(
-        f"Recording APT satellite {satellite.name} at {satellite.frequency}MHz to '{filename}'"
+        f"Recording APT satellite {satellite.name} at {satellite.frequency}MHz "
+        f"on radio {radio.device} to '{filename}'"
     )
 
-    # Build command. We receive with rtl_fm and output a .wav with ffmpeg
-    command = (
-        f"rtl_fm -f {str(satellite.frequency)}M -s 48000 -p -6 - | "
-        f"ffmpeg -hide_banner -f s16le -channels 1 -sample_rate 48k -i pipe:0 -f wav '{filename}.wav'"
+    # We receive with rtl_fm, demodulating the image as it arrives and/or
+    # writing a .wav with ffmpeg
+    radio.process = subprocess.Popen(
+        [
+            "rtl_fm",
+            "-d",
+            str(radio.device),
+            "-f",
+            f"{satellite.frequency}M",
+            "-s",
+            "48000",
+            "-p",
+            str(radio.ppm),
+            "-",
+        ],
+        stdout=subprocess.PIPE,
     )
-    subprocess.Popen([command], shell=True)
+    encoder = None
+    if not config.apt_native or config.apt_archive_wav:
+        encoder = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-hide_banner",
+                "-f",
+                "s16le",
+                "-channels",
+                "1",
+                "-sample_rate",
+                "48k",
+                "-i",
+                "pipe:0",
+                "-f",
+                "wav",
+                f"{filename}.wav",
+            ],
+            stdin=subprocess.PIPE if config.apt_native else radio.process.stdout,
+        )
+    if config.apt_native:
+        import apt
+
+        demodulator = apt.AptDemodulator()
+        sinks = [demodulator] + ([encoder.stdin] if encoder is not None else [])
+        stream_pump = streaming.pump(radio.process.stdout, sinks)
+    else:
+        radio.process.stdout.close()
 
     # Wait until pass is over
-    while end_time >= datetime.utcnow():
-        time.sleep(1)
+    waitForLOS(radio, end_time)
 
-    # End our command
-    subprocess.Popen("killall rtl_fm".split(" "))
+    # End our receiver only, ffmpeg exits at the end of its input, and hand
+    # the radio to the next pass before finishing the files
+    release()
 
     logger.info(f"LOS {satellite.name}...")
 
-    # Give it some time to exit and queue the decoding
-    time.sleep(10)
+    # The image is ready as soon as the stream ended
+    if config.apt_native:
+        stream_pump.join()
+        try:
+            apt.writeImage(
+                demodulator.samples(), filename, passcache.isAscending(passobj)
+            )
+        except Exception:
+            logger.exception(f"Failed to decode APT '{filename}'")
+
+    # Let ffmpeg finish the file and queue the decoding
+    if encoder is not None:
+        waitForExit(encoder)
     return (filename, date)
 
 
 # LRPT Pass record function
-def recordLRPT(satellite, end_time):
+def recordLRPT(satellite, end_time, radio, passobj, release):
     logger.info(f"AOS {satellite.name}...")
     date = datetime.utcnow()
 
@@ -162,46 +238,186 @@ def recordLRPT(satellite, end_time):
         + datetime.utcnow().strftime("%Y%m%d-%H%M%S")
     )
     logger.info(
-        f"Recording LRPT satellite {satellite.name} at {satellite.frequency}Mhz to '{filename}'"
+        f"Recording LRPT satellite {satellite.name} at {satellite.frequency}Mhz "
+        f"on radio {radio.device} to '{filename}'"
     )
 
-    # Build command. We receive with rtl_fm and output a raw output to feed into the demodulator
-    command = f"rtl_fm -M raw -s 140000 -f {str(satellite.frequency)}M -p -6 -E dc '{filename}.raw'"
-    subprocess.Popen([command], shell=True)
+    # We receive with rtl_fm and output a raw output to feed into the demodulator
+    receiver = [
+        "rtl_fm",
+        "-d",
+        str(radio.device),
+        "-M",
+        "raw",
+        "-s",
+        "140000",
+        "-f",
+        f"{satellite.frequency}M",
+        "-p",
+        str(radio.ppm),
+        "-E",
+        "dc",
+    ]
+    if (
+        not config.capture_enabled
+        and not config.streaming_enabled
+        and not config.doppler_enabled
+    ):
+        radio.process = subprocess.Popen(receiver + [f"{filename}.raw"])
+
+        # Wait until pass is over
+        waitForLOS(radio, end_time)
+
+        # End our receiver, the recording is complete once it exited
+        release()
+
+        logger.info(f"LOS {satellite.name} ...")
+        return (filename, date, dict())
+
+    # Otherwise the receiver output goes through us, to be corrected,
+    # demodulated and/or captured as it arrives
+    radio.process = subprocess.Popen(receiver + ["-"], stdout=subprocess.PIPE)
+    sinks = list()
+    demodulator = None
+    if config.streaming_enabled:
+        demodulator = subprocess.Popen(
+            demodulatorCommand(satellite, "/dev/stdin", filename),
+            stdin=subprocess.PIPE,
+        )
+        sinks.append(demodulator.stdin)
+    writer = None
+    if not config.streaming_enabled or config.streaming_archive_raw:
+        if config.capture_enabled:
+            import capture
+
+            seconds = max(0, (end_time - date).total_seconds())
+            writer = capture.CaptureWriter(
+                f"{filename}.raw",
+                int(seconds * storage.RECORDING_RATES["LRPT"]),
+                config.capture_buffer * storage.MB,
+                storage.RECORDING_RATES["LRPT"],
+            )
+            sinks.append(writer)
+        else:
+            sinks.append(open(f"{filename}.raw", "wb"))
+
+    corrector = None
+    if config.doppler_enabled:
+        import doppler
+
+        corrector = doppler.DopplerCorrector(
+            satellite,
+            date,
+            max(end_time, passobj.los) + timedelta(seconds=doppler.TABLE_MARGIN),
+            140000,
+        )
+    stream_pump = streaming.pump(radio.process.stdout, sinks, corrector)
 
     # Wait until pass is over
-    while end_time >= datetime.utcnow():
-        time.sleep(1)
-
-    # End our command
-    subprocess.Popen("killall rtl_fm".split())
+    waitForLOS(radio, end_time)
 
+    # End our receiver, the demodulator finishes on the end of its input, and
+    # hand the radio to the next pass before flushing the recording
+    release()
     logger.info(f"LOS {satellite.name} ...")
+    stream_pump.join()
+    if demodulator is not None:
+        waitForExit(demodulator)
+    logger.info(f"Streamed {stream_pump.bytes_copied} bytes of {satellite.name}")
+    if writer is None:
+        return (filename, date, dict())
+
+    report = writer.report()
+    if report["capture_missing_bytes"] > 0:
+        logger.warning(
+            f"Capture of {satellite.name} is about "
+            f"{report['capture_missing_bytes']} bytes short of the sample rate"
+        )
+    metrics.increment(
+        "auto137_capture_missing_bytes_total", report["capture_missing_bytes"]
+    )
+    return (filename, date, report)
 
-    # Give it some time to exit and queue the decoding
-    time.sleep(10)
-    return (filename, date)
+
+# Total size of the files of a recording
+def recordedBytes(filename):
+    size = 0
+    for extension in (".wav", ".raw", ".lrpt"):
+        try:
+            size += os.path.getsize(filename + extension)
+        except OSError:
+            pass
+    return size
+
+
+# Job run at AOS, rebuilding the pass from its scheduled arguments
+def recordScheduledPass(norad, aos, tca, los, max_elevation, end_time, radio=0):
+    satellite = next((s for s in config.satellites if s.norad == norad), None)
+    if satellite is None:
+        logger.error(f"Satellite {norad} is no longer configured, pass skipped")
+        return
+    recordPass(
+        satellite, end_time, Pass(satellite, aos, tca, los, max_elevation), radio
+    )
 
 
 # Downlink mode redirection
-def recordPass(satellite, end_time, passobj):
-    # Lock the radio to prevent any issues
-    core.radio_lock.acquire()
+def recordPass(satellite, end_time, passobj, radio=0):
+    # Never fill the disk
+    if not storage.canRecord(satellite, (end_time - datetime.utcnow()).total_seconds()):
+        metrics.increment("auto137_passes_total", outcome="refused")
+        return
+
+    # Take a radio for ourselves, the planned one if it is free
+    start = time.monotonic()
+    radio = core.radio_pool.acquire(radio)
+    radio_wait = time.monotonic() - start
+    metrics.observe("radio_wait", radio_wait)
 
     filename = str()
     date = 0
+    report = dict()
 
-    # Record the pass!
-    if satellite.downlink == "APT":
-        filename, date = recordAPT(satellite, end_time)
-    elif satellite.downlink == "LRPT":
-        filename, date = recordLRPT(satellite, end_time)
+    # The radio goes back to the pool as soon as the receiver stopped at LOS,
+    # so a following pass on it isn't held up by the end of this one
+    released = False
 
-    # Release the radio
-    core.radio_lock.release()
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            radio.stop()
+            core.radio_pool.release(radio)
+
+    # Record the pass!
+    start = time.monotonic()
+    try:
+        with metrics.timed("recording", satellite=satellite.name):
+            if satellite.downlink == "APT":
+                filename, date = recordAPT(satellite, end_time, radio, passobj, release)
+            elif satellite.downlink == "LRPT":
+                filename, date, report = recordLRPT(
+                    satellite, end_time, radio, passobj, release
+                )
+    finally:
+        # Release the radio if the recording failed before LOS
+        release()
+    recording = Recording(satellite, filename, date, passobj)
+
+    size = recordedBytes(filename)
+    metrics.increment("auto137_recorded_bytes_total", size, satellite=satellite.name)
+    metrics.increment("auto137_passes_total", outcome="recorded")
+    recording.summary.update(
+        radio=radio.device,
+        radio_wait=radio_wait,
+        recording=time.monotonic() - start,
+        recorded_bytes=size,
+        **report,
+    )
 
     # Queue decoding
-    core.decoding_queue.append(Recording(satellite, filename, date, passobj))
+    recording.summary["queued_behind"] = core.decoder.pending()
+    core.decoder.submit(recording)
 
 
 # Decode APT file
@@ -211,23 +427,30 @@ def decodeAPT(filename, satellite: Satellite, passobj):
     sate_name = satellite.name.lower()
     logger.info(f"Decoding APT {sate_name} in '{filename}'")
 
-    # get if pas is ascending (South to North)
-    # TODO: move somewhere else and cleanup
-    predictor = satellite.get_predictor()
-    lat_at_aos = predictor.get_position(passobj.aos).position_llh[0]
-    lat_after_aos = predictor.get_position(
-        passobj.aos + timedelta(seconds=1)
-    ).position_llh[0]
-    is_ascending = lat_after_aos > lat_at_aos
-
-    command = f"noaa-apt --rotate {'yes' if is_ascending else 'no'} -s {sate_name} '{filename}.wav' -o '{filename}.png'"
-
-    # Run and delete the recording to save disk space
-    if (
-        subprocess.Popen([command], shell=True).wait() == 0
-        and satellite.delete_processed_files
-    ):
-        os.remove(filename + ".wav")
+    # get if pas is ascending (South to North) from the cached ground track
+    is_ascending = passcache.isAscending(passobj)
+
+    # Decode the recording, unless it was decoded while being received
+    steps = list()
+    decoded = list()
+    if not os.path.exists(filename + ".png"):
+        if config.apt_native:
+            import apt
+
+            action = partial(apt.decodeWAV, filename + ".wav", filename, is_ascending)
+            steps.append(Step("apt", action))
+            decoded.append("apt")
+        else:
+            command = f"noaa-apt --rotate {'yes' if is_ascending else 'no'} -s {sate_name} '{filename}.wav' -o '{filename}.png'"
+            steps.append(Step("noaa-apt", command))
+            decoded.append("noaa-apt")
+
+    # Delete the recording to save disk space
+    if satellite.delete_processed_files and os.path.exists(filename + ".wav"):
+        steps.append(
+            Step("remove-wav", partial(removeFile, filename + ".wav"), decoded)
+        )
+    Pipeline(f"APT '{filename}'", steps).run()
 
     # Return a list of produced outputs
     output_files.append(filename + ".png")
@@ -237,80 +460,97 @@ def decodeAPT(filename, satellite: Satellite, passobj):
     return output_files
 
 
-# Decode LRPT file
-def decodeLRPT(filename, satellite):
-    output_files = list()
-    logger.info(f"Demodulating LRPT '{filename}'")
-
-    # Demodulate with meteor_demod
+# meteor_demod command reading IQ samples from source
+def demodulatorCommand(satellite, source, filename):
+    command = ["meteor_demod", "-B", "-s", "140000", source, "-o", f"{filename}.lrpt"]
     if satellite.name == "METEOR-M2_2":  # Add OQPSK mode for M2 sates
-        command = (
-            f"meteor_demod -m oqpsk -B -s 140000 '{filename}.raw' -o '{filename}.lrpt'"
-        )
-    else:
-        command = f"meteor_demod -B -s 140000 '{filename}.raw' -o '{filename}.lrpt'"
+        command[1:1] = ["-m", "oqpsk"]
+    return command
+
+
+# Delete an intermediate file once it has been processed
+def removeFile(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        logger.error(f"File {path} not found. Symptom that a step failed silently.")
 
-    if (
-        subprocess.Popen([command], shell=True).wait() == 0
-        and satellite.delete_processed_files
-    ):
-        os.remove(filename + ".raw")
+
+# Decode LRPT file
+def decodeLRPT(filename, satellite):
+    import capture
+    import imaging
 
     logger.info(f"Decoding LRPT '{filename}'")
+    steps = list()
+    demodulated = list()
 
-    # Decode with meteor_decoder. Both IR & Visible
-    command1 = f"medet '{filename}.lrpt' '{filename}-Visible' -r 65 -g 65 -b 64"
-    command2 = f"medet '{filename}.lrpt' '{filename}-Infrared' -r 68 -g 68 -b 68"
-    if satellite.name == "METEOR-M2_2":  # Add -diff coding for M2 sates
-        command1 += " -diff"
-        command2 += " -diff"
-    process2 = subprocess.Popen([command2], shell=True)
+    # A receiver failing during the pass leaves a capture of zeros, nothing
+    # to demodulate there
+    raw = filename + ".raw"
     if (
-        subprocess.Popen([command1], shell=True).wait() == 0
-        and process2.wait() == 0
-        and satellite.delete_processed_files
+        not os.path.exists(filename + ".lrpt")
+        and os.path.exists(raw)
+        and capture.isSilent(raw)
     ):
-        try:
-            os.remove(filename + ".lrpt")
-        except FileNotFoundError:
-            logger.error(
-                f"File {filename}.lrpt not found. Might be because meteor_demod failed silently."
+        logger.error(f"'{raw}' holds no signal, not decoding it")
+        if satellite.delete_processed_files:
+            removeFile(raw)
+        return list()
+
+    # Demodulate with meteor_demod, unless it was streamed during the pass
+    if not os.path.exists(filename + ".lrpt"):
+        command = demodulatorCommand(satellite, f"{filename}.raw", filename)
+        steps.append(Step("meteor_demod", command))
+        demodulated.append("meteor_demod")
+        if satellite.delete_processed_files:
+            steps.append(
+                Step("remove-raw", partial(removeFile, filename + ".raw"), demodulated)
             )
 
-    # Convert to png to save on space
-    command1 = (
-        f"ffmpeg -hide_banner -i '{filename}-Visible.bmp' '{filename}-Visible.png' "
-    )
-    command2 = (
-        f"ffmpeg -hide_banner -i '{filename}-Infrared.bmp' '{filename}-Infrared.png' "
-    )
-    if (
-        subprocess.Popen([command1], shell=True).wait() == 0
-        and subprocess.Popen([command2], shell=True).wait() == 0
-        and satellite.delete_processed_files
-    ):
-        try:
-            os.remove(filename + "-Visible.bmp")
-            os.remove(filename + "-Infrared.bmp")
-        except FileNotFoundError:
-            logger.error(
-                f"No bitmaps found for {filename}. Symptom that medet command has failed silently"
+    # Both IR & Visible are processed concurrently
+    for channel, colors in LRPT_CHANNELS.items():
+        output = f"{filename}-{channel}"
+
+        # Decode with meteor_decoder
+        command = f"medet '{filename}.lrpt' '{output}' {colors}"
+        if satellite.name == "METEOR-M2_2":  # Add -diff coding for M2 sates
+            command += " -diff"
+        steps.append(Step(f"medet-{channel}", command, demodulated))
+
+        # Convert to png to save on space, correcting image geometry
+        if config.imaging_in_process:
+            action = partial(imaging.convertBitmap, output)
+        else:
+            action = f"ffmpeg -hide_banner -i '{output}.bmp' '{output}.png'"
+        steps.append(Step(f"png-{channel}", action, [f"medet-{channel}"]))
+        if satellite.delete_processed_files:
+            steps.append(
+                Step(
+                    f"remove-bmp-{channel}",
+                    partial(removeFile, output + ".bmp"),
+                    [f"png-{channel}"],
+                )
             )
+        if not config.imaging_in_process:
+            command = f"python3 /home/pi/src/meteor_corrector/correct.py '{output}.png' -o '{output}.png'"
+            steps.append(Step(f"correct-{channel}", command, [f"png-{channel}"]))
+
+    if satellite.delete_processed_files:
+        steps.append(
+            Step(
+                "remove-lrpt",
+                partial(removeFile, filename + ".lrpt"),
+                [f"medet-{channel}" for channel in LRPT_CHANNELS],
+            )
+        )
 
-    # Correct image geometry
-    command1 = f"python3 /home/pi/src/meteor_corrector/correct.py '{filename}-Visible.png' -o '{filename}-Visible.png'"
-    command2 = f"python3 /home/pi/src/meteor_corrector/correct.py '{filename}-Infrared.png' -o '{filename}-Infrared.png'"
-
-    subprocess.Popen([command1], shell=True).wait()
-    subprocess.Popen([command2], shell=True).wait()
-
-    # Return a list of produced outputs
-    output_files.append(filename + "-Visible.png")
-    output_files.append(filename + "-Infrared.png")
+    Pipeline(f"LRPT '{filename}'", steps).run()
 
     logger.info(f"Done decoding LRPT '{filename}'!")
 
-    return output_files
+    # Return a list of produced outputs
+    return [f"{filename}-{channel}.png" for channel in LRPT_CHANNELS]
 
 
 # Redirect to the right decoder function
@@ -323,6 +563,10 @@ def decodePass(filename, satellite, date, passobj):
     else:
         return
 
+    # Nothing came out of the recording
+    if not output_files:
+        return output_files
+
     # Add on the RSS feed if enabled
     if config.rss_enabled:
         import rss
@@ -342,33 +586,65 @@ def decodePass(filename, satellite, date, passobj):
 
         if passobj.max_elevation_deg >= config.post_processing_hook_min_elevation:
             if config.post_processing_hook_daytime_only and is_daytime:
-                if config.post_processing_hook_foreach:
-                    for file_out in output_files:
-                        command = config.post_processing_hook_command.replace(
-                            "{file}", f"'{file_out}'"
-                        )
-                        subprocess.Popen([command], shell=True).wait()
-                else:
-                    file_list = str()
-                    for file_out in output_files:
-                        file_list += f"'{file_out}' "
-                    command = config.post_processing_hook_command.replace(
-                        "{file}", file_list
-                    )
-                    subprocess.Popen([command], shell=True).wait()
-
-
-# Process pending decodings
-def processDecodeQueue():
-    while True:
-        time.sleep(1)
-        if len(core.decoding_queue) > 0:
-            decode = core.decoding_queue[0]
-            decodePass(decode.filename, decode.satellite, decode.date, decode.passobj)
-            core.decoding_queue.remove(decode)
+                # Run in the background, once per file or for all of them
+                core.hook_runner.submit(output_files)
+
+    # Publish the images if enabled
+    if core.publisher is not None:
+        if passobj.max_elevation_deg >= config.publisher_min_elevation:
+            if not config.publisher_daytime_only or pass_at_daytime(
+                passobj.aos,
+                config.location.latitude_deg,
+                config.location.longitude_deg,
+                config.location.elevation_m,
+            ):
+                core.publisher.submit(output_files)
+
+    return output_files
+
+
+# Decode a recording taken from the decoding queue
+def decodeRecording(recording):
+    satellite, passobj = recording.satellite, recording.passobj
+    start = time.monotonic()
+    outcome = "failed"
+    output_files = list()
+    try:
+        with metrics.timed("decoding", satellite=satellite.name):
+            output_files = decodePass(
+                recording.filename, satellite, recording.date, passobj
+            )
+        outcome = "decoded"
+    finally:
+        metrics.increment("auto137_passes_total", outcome=outcome)
+        if config.metrics_pass_summary and recording.filename:
+            metrics.writePassSummary(
+                recording.filename,
+                {
+                    "satellite": satellite.name,
+                    "aos": passobj.aos,
+                    "los": passobj.los,
+                    "max_elevation": passobj.max_elevation_deg,
+                    "outcome": outcome,
+                    **recording.summary,
+                    "decoding": time.monotonic() - start,
+                    "steps": getattr(decoding.current_job, "steps", None) or [],
+                    "outputs": [
+                        os.path.basename(path)
+                        for path in output_files or []
+                        if os.path.exists(path)
+                    ],
+                },
+            )
+
+        # Compress whatever raw recording is left
+        if recording.filename:
+            storage.archive(recording.filename)
 
 
 def pass_at_daytime(aos, lat, lon, elev) -> bool:
+    import ephem
+
     sun = ephem.Sun()
     observer = ephem.Observer()
     observer.lat, observer.lon, observer.elevation = lat, lon, elev
@@ -0,0 +1,112 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import decoding
+import metrics
+
+logger = logging.getLogger("main.pipeline")
+
+
+# A decoding step, either an external command or a python callable, started
+# once every step it requires has succeeded
+class Step:
+    def __init__(self, name, action, requires=()):
+        self.name = name
+        self.action = action
+        self.requires = list(requires)
+        self.status = "pending"
+        self.returncode = None
+        self.duration = None
+
+    def run(self, deadline):
+        start = time.monotonic()
+        try:
+            if callable(self.action):
+                self.action()
+                self.returncode = 0
+            else:
+                self.returncode = decoding.run(self.action, deadline)
+        except decoding.DecodeTimeout:
+            self.status = "timeout"
+            raise
+        except Exception:
+            logger.exception(f"Step {self.name} failed")
+            self.returncode = -1
+        finally:
+            self.duration = time.monotonic() - start
+        self.status = "done" if self.returncode == 0 else "failed"
+
+    def report(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "returncode": self.returncode,
+            "duration": self.duration,
+        }
+
+
+# A set of steps run with as much parallelism as their dependencies allow
+class Pipeline:
+    def __init__(self, name, steps):
+        self.name = name
+        self.steps = {step.name: step for step in steps}
+
+    def _ready(self, step):
+        return all(self.steps[name].status == "done" for name in step.requires)
+
+    def _blocked(self, step):
+        return any(
+            self.steps[name].status in ("failed", "skipped", "timeout")
+            for name in step.requires
+        )
+
+    def run(self, deadline=None):
+        # Steps run on other threads, so they get the job's deadline explicitly
+        if deadline is None:
+            deadline = getattr(decoding.current_job, "deadline", None)
+
+        start = time.monotonic()
+        pending = list(self.steps.values())
+        running = dict()
+        timed_out = False
+        with ThreadPoolExecutor(max_workers=len(pending) or 1) as pool:
+            while pending or running:
+                for step in list(pending):
+                    if self._blocked(step):
+                        step.status = "skipped"
+                        pending.remove(step)
+                    elif self._ready(step):
+                        step.status = "running"
+                        running[pool.submit(step.run, deadline)] = step
+                        pending.remove(step)
+
+                if not running:
+                    for step in pending:
+                        step.status = "skipped"
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    running.pop(future)
+                    if isinstance(future.exception(), decoding.DecodeTimeout):
+                        timed_out = True
+
+        # Report every step, in the logs, the metrics and the job summary
+        reports = getattr(decoding.current_job, "steps", None)
+        for step in self.steps.values():
+            if reports is not None:
+                reports.append(step.report())
+            if step.duration is None:
+                logger.info(f"{self.name}: {step.name} {step.status}")
+            else:
+                metrics.observe("step", step.duration, step=step.name)
+                logger.info(
+                    f"{self.name}: {step.name} {step.status} "
+                    f"(exit {step.returncode}) in {step.duration:.1f}s"
+                )
+        logger.info(f"{self.name}: done in {time.monotonic() - start:.1f}s")
+
+        if timed_out:
+            raise decoding.DecodeTimeout(f"{self.name} timed out")
+        return self
@@ -0,0 +1,264 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import config
+import planner
+import tle
+
+logger = logging.getLogger("main.plan")
+
+FORMATS = ("table", "json", "ics")
+
+# Seconds taken by each phase of the planning
+timings = dict()
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+
+
+def _utc(date):
+    return date.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _ics(date):
+    return date.strftime("%Y%m%dT%H%M%SZ")
+
+
+# Satellite of a command line name, either its verbose or file name
+def _satellite(name):
+    for satellite in config.satellites:
+        if name in (satellite.verbose_name, satellite.name):
+            return satellite
+    raise SystemExit(f"No satellite named '{name}' in the configuration")
+
+
+# Give the satellites their elements, fetching only those missing from the
+# catalog unless offline
+def loadTLEs(offline, refresh):
+    if refresh and not offline:
+        tle.refresh(config.satellites)
+    elif not tle.applyCached(config.satellites):
+        if not offline:
+            tle.refresh(config.satellites)
+        else:
+            for satellite in config.satellites:
+                if not satellite.has_tle():
+                    logger.error(f"No cached TLE for {satellite.verbose_name}")
+    return [satellite for satellite in config.satellites if satellite.has_tle()]
+
+
+def formatTable(plan):
+    lines = [
+        f"{'AOS (UTC)':19}  {'LOS (UTC)':19}  {'Satellite':16} {'Radio':>5} "
+        f"{'Elev':>5} {'Length':>7}  Note"
+    ]
+    for planned in plan.planned:
+        length = (planned.los - planned.aos).total_seconds()
+        note = "trimmed" if planned.trimmed else ""
+        lines.append(
+            f"{_utc(planned.aos)}  {_utc(planned.los)}  "
+            f"{planned.satellite.verbose_name:16} {planned.radio:5} "
+            f"{planned.passobj.max_elevation_deg:4.0f}° {length / 60:6.1f}m  {note}".rstrip()
+        )
+    lines.append("")
+    lines.append(f"{len(plan.planned)} planned, {len(plan.dropped)} dropped")
+    lines += ["  " + line for line in plan.report()]
+    return "\n".join(lines) + "\n"
+
+
+def formatJSON(plan, start, end, radios):
+    planned = [
+        {
+            "satellite": planned.satellite.verbose_name,
+            "norad": planned.satellite.norad,
+            "downlink": planned.satellite.downlink,
+            "radio": planned.radio,
+            "aos": planned.aos.isoformat(),
+            "los": planned.los.isoformat(),
+            "tca": planned.passobj.tca.isoformat(),
+            "max_elevation": planned.passobj.max_elevation_deg,
+            "trimmed": planned.trimmed,
+        }
+        for planned in plan.planned
+    ]
+    dropped = [
+        {
+            "satellite": passobj.satellite.verbose_name,
+            "norad": passobj.satellite.norad,
+            "aos": passobj.aos.isoformat(),
+            "los": passobj.los.isoformat(),
+            "max_elevation": passobj.max_elevation_deg,
+            "reason": reason,
+        }
+        for passobj, reason in plan.dropped
+    ]
+    return (
+        json.dumps(
+            {
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "maximum_overlap": config.maximum_overlap,
+                "radios": radios,
+                "planned": planned,
+                "dropped": dropped,
+                "timings": timings,
+            },
+            indent=1,
+        )
+        + "\n"
+    )
+
+
+# iCalendar of the planned passes, to follow the station from a calendar app
+def formatICS(plan):
+    now = _ics(datetime.utcnow())
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Auto137//Pass plan//EN",
+        "CALSCALE:GREGORIAN",
+    ]
+    for planned in plan.planned:
+        satellite = planned.satellite
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:pass-{satellite.norad}-{planned.aos:%Y%m%d%H%M%S}@auto137",
+            f"DTSTAMP:{now}",
+            f"DTSTART:{_ics(planned.aos)}",
+            f"DTEND:{_ics(planned.los)}",
+            f"SUMMARY:{satellite.verbose_name} "
+            f"({planned.passobj.max_elevation_deg:.0f}°)",
+            f"DESCRIPTION:{satellite.downlink} at {satellite.frequency}MHz "
+            f"on radio {planned.radio}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the passes Auto137 would record, without any radio"
+    )
+    parser.add_argument("--config", default="config.yaml", help="configuration file")
+    parser.add_argument(
+        "--start", help="start of the plan, as UTC ISO date (default: now)"
+    )
+    parser.add_argument(
+        "--days",
+        type=float,
+        help="horizon in days (default: prediction_horizon of the configuration)",
+    )
+    parser.add_argument("--format", choices=FORMATS, default="table")
+    parser.add_argument("--output", help="file to write the plan to (default: stdout)")
+    parser.add_argument(
+        "--satellite",
+        action="append",
+        help="only plan this satellite, may be repeated",
+    )
+    parser.add_argument(
+        "--priority",
+        action="append",
+        default=list(),
+        metavar="NAME=LEVEL",
+        help="override the priority of a satellite, may be repeated",
+    )
+    parser.add_argument("--max-overlap", type=int, help="override max_overlap")
+    parser.add_argument("--radios", type=int, help="override the number of radios")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="predict every pass instead of using the pass cache",
+    )
+    parser.add_argument(
+        "--offline", action="store_true", help="only use the cached TLEs"
+    )
+    parser.add_argument(
+        "--refresh-tle", action="store_true", help="fetch the TLEs of every satellite"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(levelname)s - %(name)s : %(message)s",
+    )
+
+    with phase("config"):
+        try:
+            config.loadConfig(args.config)
+        except config.ConfigError as ex:
+            raise SystemExit(str(ex))
+        if args.satellite:
+            config.satellites = [_satellite(name) for name in args.satellite]
+        for override in args.priority:
+            name, _, level = override.rpartition("=")
+            _satellite(name).priority = int(level)
+        if args.max_overlap is not None:
+            config.maximum_overlap = args.max_overlap
+        radios = len(config.radios) if args.radios is None else args.radios
+        start = datetime.fromisoformat(args.start) if args.start else datetime.utcnow()
+        days = config.prediction_horizon if args.days is None else args.days
+        end = start + timedelta(days=days)
+        os.makedirs(config.output_dir, exist_ok=True)
+
+    with phase("tle"):
+        satellites = loadTLEs(args.offline, args.refresh_tle)
+    if not satellites:
+        raise SystemExit("No satellite has a TLE, nothing to plan")
+
+    with phase("prediction"):
+        import passcache
+        import predict
+
+        if args.no_cache:
+            passes = predict.predictPasses(satellites, start=start, days=days)
+        else:
+            passes = passcache.getPasses(satellites, start=start, days=days)
+
+    with phase("planning"):
+        plan = planner.planPasses(passes, config.maximum_overlap, radios)
+
+    with phase("format"):
+        if args.format == "json":
+            text = formatJSON(plan, start, end, radios)
+        elif args.format == "ics":
+            text = formatICS(plan)
+        else:
+            text = formatTable(plan)
+
+    # The JSON plan is rendered again to include the time taken to format it,
+    # only writing it being left out of its timings
+    if args.format == "json":
+        text = formatJSON(plan, start, end, radios)
+
+    with phase("write"):
+        if args.output:
+            with open(args.output, "w", encoding="utf-8", newline="") as f:
+                f.write(text)
+        else:
+            sys.stdout.write(text)
+
+    print(
+        f"{len(passes)} passes of {len(satellites)} satellite(s) over {days:g} day(s): "
+        + ", ".join(
+            f"{name} {seconds * 1000:.1f}ms" for name, seconds in timings.items()
+        ),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import logging
+from bisect import bisect_left
+from datetime import timedelta
+
+import config
+
+logger = logging.getLogger("main.planner")
+
+# One priority level is always worth more than any elevation difference
+PRIORITY_WEIGHT = 100
+
+
+# A pass retained by the plan, recorded between aos and los
+class PlannedPass:
+    def __init__(self, passobj, aos, los, radio=0):
+        self.passobj = passobj
+        self.satellite = passobj.satellite
+        self.aos = aos
+        self.los = los
+        self.radio = radio
+        self.trimmed = los < passobj.los
+
+    def __repr__(self):
+        return (
+            f"<PlannedPass {self.satellite.name} from {self.aos} to {self.los} "
+            f"on radio {self.radio}>"
+        )
+
+
+# Result of the planning: retained passes and the reasons others were dropped
+class Plan:
+    def __init__(self, planned, dropped):
+        self.planned = planned
+        self.dropped = dropped
+
+    # Lines explaining the trimmed and dropped passes, only those starting
+    # between start and end if given
+    def report(self, start=None, end=None):
+        def within(aos):
+            return (start is None or start <= aos) and (end is None or aos < end)
+
+        lines = list()
+        for planned in self.planned:
+            if planned.trimmed and within(planned.aos):
+                lost = (planned.passobj.los - planned.los).total_seconds()
+                lines.append(
+                    f"Trimmed {planned.satellite.name} pass at {planned.aos} "
+                    f"by {lost:.0f}s to end at {planned.los} on radio {planned.radio}"
+                )
+        for passobj, reason in self.dropped:
+            if not within(passobj.aos):
+                continue
+            lines.append(
+                f"Dropped {passobj.satellite.name} pass at {passobj.aos}: {reason}"
+            )
+        return lines
+
+
+# Value of recording a pass for the given usable duration
+def passValue(passobj, usable_s):
+    weight = PRIORITY_WEIGHT * (1 + passobj.satellite.priority)
+    weight += passobj.max_elevation_deg
+    return weight * usable_s / passobj.duration_s
+
+
+def _describe(passobj):
+    return (
+        f"{passobj.satellite.name} at {passobj.aos} "
+        f"(priority {passobj.satellite.priority}, {passobj.max_elevation_deg:.0f}°)"
+    )
+
+
+# Pick the passes of maximum total value for a single radio
+def _schedule(passes, maximum_overlap):
+    # Weighted interval scheduling over passes sorted by AOS. best[i] is the
+    # value of the best schedule starting with pass i, suffix[i] the best one
+    # starting at or after pass i. A pass either ends before the next one or
+    # is trimmed to the AOS of a pass starting at most maximum_overlap before
+    # its LOS, which only scans the few passes starting in that window.
+    passes = sorted(passes)
+    starts = [passobj.aos for passobj in passes]
+    count = len(passes)
+    best = [0.0] * count
+    following = [None] * count
+    suffix = [0.0] * (count + 1)
+    for i in range(count - 1, -1, -1):
+        passobj = passes[i]
+        j = bisect_left(starts, passobj.los, i + 1)
+        best[i] = passValue(passobj, passobj.duration_s) + suffix[j]
+        following[i] = (j, False)
+        for k in range(bisect_left(starts, passobj.los - maximum_overlap, i + 1), j):
+            if starts[k] <= passobj.aos:
+                continue
+            usable_s = (starts[k] - passobj.aos).total_seconds()
+            value = passValue(passobj, usable_s) + best[k]
+            if value > best[i]:
+                best[i] = value
+                following[i] = (k, True)
+        suffix[i] = max(best[i], suffix[i + 1])
+
+    # Walk the best schedule, a trimmed pass forcing the one that trims it
+    chosen = list()
+    i = 0
+    forced = False
+    while i < count:
+        if not forced and best[i] < suffix[i]:
+            i += 1
+            continue
+        chosen.append(passes[i])
+        i, forced = following[i]
+
+    return chosen
+
+
+# Give each pass, in AOS order, to a radio free for its whole window. When all
+# of them are busy the pass ending first is trimmed to make room, which never
+# cuts more than maximum_overlap since the passes were picked to fit in as
+# many radios with such trims.
+def _assign(passes, radios):
+    planned = list()
+    last = [None] * radios
+    for passobj in passes:
+        free = [
+            radio
+            for radio in range(radios)
+            if last[radio] is None or last[radio].los <= passobj.aos
+        ]
+        if free:
+            radio = free[0]
+        else:
+            radio = min(range(radios), key=lambda radio: last[radio].los)
+            previous = last[radio]
+            previous.los = passobj.aos
+            previous.trimmed = previous.los < previous.passobj.los
+        last[radio] = PlannedPass(passobj, passobj.aos, passobj.los, radio)
+        planned.append(last[radio])
+    return planned
+
+
+# Add the remaining passes fitting untrimmed in the gaps of a radio, the most
+# valuable first
+def _fill(planned, remaining, radios):
+    windows = [list() for _ in range(radios)]
+    for planned_pass in sorted(planned, key=lambda p: p.aos):
+        windows[planned_pass.radio].append((planned_pass.aos, planned_pass.los))
+
+    dropped = list()
+    for passobj in sorted(remaining, key=lambda p: -passValue(p, p.duration_s)):
+        for radio, window in enumerate(windows):
+            i = bisect_left(window, (passobj.aos,))
+            if (i == 0 or window[i - 1][1] <= passobj.aos) and (
+                i == len(window) or window[i][0] >= passobj.los
+            ):
+                window.insert(i, (passobj.aos, passobj.los))
+                planned.append(PlannedPass(passobj, passobj.aos, passobj.los, radio))
+                break
+        else:
+            dropped.append(passobj)
+    return planned, sorted(dropped)
+
+
+# Pick the set of passes of maximum total value, trimming them by at most
+# maximum_overlap minutes. Radios are filled one after the other, each one
+# getting the best plan out of the passes left over by the previous ones, then
+# the retained passes are spread over the radios so that a pass is only
+# trimmed when every radio is busy.
+def planPasses(passes, maximum_overlap=None, radios=None):
+    if maximum_overlap is None:
+        maximum_overlap = config.maximum_overlap
+    if radios is None:
+        radios = len(config.radios)
+    maximum_overlap = timedelta(minutes=maximum_overlap)
+
+    chosen = list()
+    remaining = sorted(passes)
+    for radio in range(radios):
+        retained = _schedule(remaining, maximum_overlap)
+        chosen += retained
+        kept = set(id(passobj) for passobj in retained)
+        remaining = [passobj for passobj in remaining if id(passobj) not in kept]
+
+    planned = _assign(sorted(chosen), radios)
+
+    # Passes dropped by the first radios may fit untrimmed on another one now
+    # that the retained passes are spread over all of them
+    if radios > 1 and remaining:
+        planned, remaining = _fill(planned, remaining, radios)
+    planned.sort(key=lambda planned_pass: planned_pass.aos)
+
+    # Explain why the other passes were dropped
+    dropped = list()
+    planned_starts = [planned_pass.aos for planned_pass in planned]
+    longest = max(
+        (planned_pass.los - planned_pass.aos for planned_pass in planned),
+        default=timedelta(0),
+    )
+    for passobj in remaining:
+        conflicts = [
+            planned_pass.passobj
+            for planned_pass in planned[
+                bisect_left(planned_starts, passobj.aos - longest) : bisect_left(
+                    planned_starts, passobj.los
+                )
+            ]
+            if planned_pass.los > passobj.aos
+        ]
+        reason = "conflicts with " + ", ".join(_describe(other) for other in conflicts)
+        dropped.append((passobj, reason))
+
+    logger.info(
+        f"Planned {len(planned)} of {len(passes)} passes on {radios} radio(s), "
+        f"{sum(p.trimmed for p in planned)} trimmed"
+    )
+    return Plan(planned, dropped)
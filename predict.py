@@ -0,0 +1,290 @@
+import logging
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+from sgp4.api import WGS84, Satrec, SatrecArray, jday
+
+import config
+
+logger = logging.getLogger("main.predict")
+
+# Coarse sweep resolution and refinement tolerance, in seconds
+GRID_STEP = 60
+TOLERANCE = 1.0
+
+# Margin swept around the horizon so passes crossing its edges are complete
+MARGIN = timedelta(minutes=30)
+
+# Passes whose coarse peak is this far under the minimum elevation are not refined
+PEAK_SLACK = 10
+
+# Satellites propagated together in a single SGP4 batch
+BATCH_SIZE = 32
+
+# Ground track sampling interval, in seconds
+TRACK_STEP = 10
+
+GOLDEN_RATIO = (1 + math.sqrt(5)) / 2
+
+# WGS-84 ellipsoid axes in km
+WGS84_A = 6378.1370
+WGS84_B = 6356.752314
+
+
+# Predicted pass class
+class Pass:
+    def __init__(self, satellite, aos, tca, los, max_elevation_deg):
+        self.satellite = satellite
+        self.aos = aos
+        self.tca = tca
+        self.los = los
+        self.max_elevation_deg = max_elevation_deg
+        self.duration_s = (los - aos).total_seconds()
+
+    # Passes sort chronologically
+    def __lt__(self, other):
+        return (self.aos, self.los) < (other.aos, other.los)
+
+    def __repr__(self):
+        return (
+            f"<Pass {self.satellite.name} on {self.aos} "
+            f"({self.max_elevation_deg:.1f}°)>"
+        )
+
+
+# Time grid shared by every satellite of a sweep
+class TimeGrid:
+    def __init__(self, start, end, step):
+        self.start = start
+        self.step = float(step)
+        self.jd, self.fr = jday(
+            start.year,
+            start.month,
+            start.day,
+            start.hour,
+            start.minute,
+            start.second + start.microsecond / 1e6,
+        )
+        count = int((end - start).total_seconds() // self.step) + 1
+        self.offsets = np.arange(count) * self.step
+
+    def datetime(self, offset):
+        return self.start + timedelta(seconds=float(offset))
+
+
+# Greenwich mean sidereal time in radians, vectorized version of sgp4's gstime
+def _gmst(jd):
+    tut1 = (jd - 2451545.0) / 36525.0
+    seconds = (
+        -6.2e-6 * tut1**3
+        + 0.093104 * tut1**2
+        + (876600.0 * 3600 + 8640184.812866) * tut1
+        + 67310.54841
+    )
+    return np.radians(seconds / 240.0) % (2 * np.pi)
+
+
+# Rotate TEME positions (..., n, 3) to ECEF components
+def _toEcef(positions, jd):
+    theta = _gmst(jd)
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    x = cos_theta * positions[..., 0] + sin_theta * positions[..., 1]
+    y = -sin_theta * positions[..., 0] + cos_theta * positions[..., 1]
+    return x, y, positions[..., 2]
+
+
+# Elevation in degrees of TEME positions (..., n, 3) seen from the location
+def _elevation(positions, jd, location):
+    x, y, z = _toEcef(positions, jd)
+
+    # Relative to the station
+    station = location.position_ecef
+    rx = x - station[0]
+    ry = y - station[1]
+    rz = z - station[2]
+
+    lat = math.radians(location.latitude_deg)
+    lon = math.radians(location.longitude_deg)
+    up_x = math.cos(lat) * math.cos(lon)
+    up_y = math.cos(lat) * math.sin(lon)
+    up_z = math.sin(lat)
+
+    with np.errstate(invalid="ignore"):
+        sin_elevation = (up_x * rx + up_y * ry + up_z * rz) / np.sqrt(
+            rx * rx + ry * ry + rz * rz
+        )
+    return np.degrees(np.arcsin(np.clip(sin_elevation, -1, 1)))
+
+
+# Elevation of a single satellite at arbitrary offsets of the grid
+def _elevationAt(satrec, grid, offsets, location):
+    fr = grid.fr + offsets / 86400.0
+    error, positions, _ = satrec.sgp4_array(np.full(offsets.shape, grid.jd), fr)
+    elevation = _elevation(positions, grid.jd + fr, location)
+    elevation[(error != 0) | np.isnan(elevation)] = -90.0
+    return elevation
+
+
+# Coarse elevation sweep for a batch of satellites, shape (satellites, grid)
+def _sweep(satrecs, grid, location):
+    fr = grid.fr + grid.offsets / 86400.0
+    error, positions, _ = SatrecArray(satrecs).sgp4(
+        np.full(grid.offsets.shape, grid.jd), fr
+    )
+    elevation = _elevation(positions, grid.jd + fr, location)
+    elevation[(error != 0) | np.isnan(elevation)] = -90.0
+    return elevation
+
+
+# Bisect horizon crossings bracketed by [lo, lo + step]
+def _refineCrossings(satrec, grid, location, lo, rising):
+    hi = lo + grid.step
+    while lo.size and np.max(hi - lo) > TOLERANCE:
+        mid = (lo + hi) / 2
+        above = _elevationAt(satrec, grid, mid, location) > 0
+        move_hi = above == rising
+        hi = np.where(move_hi, mid, hi)
+        lo = np.where(move_hi, lo, mid)
+    return (lo + hi) / 2
+
+
+# Golden section search of the culmination bracketed by [lo, hi]
+def _refineCulminations(satrec, grid, location, lo, hi):
+    while lo.size and np.max(hi - lo) > TOLERANCE:
+        c = hi - (hi - lo) / GOLDEN_RATIO
+        d = lo + (hi - lo) / GOLDEN_RATIO
+        elevation = _elevationAt(satrec, grid, np.concatenate((c, d)), location)
+        left = elevation[: c.size] > elevation[c.size :]
+        hi = np.where(left, d, hi)
+        lo = np.where(left, lo, c)
+    tca = (lo + hi) / 2
+    return tca, _elevationAt(satrec, grid, tca, location)
+
+
+# Extract and refine the passes of one satellite from its coarse sweep
+def _findPasses(satellite, satrec, elevation, grid, location, start, end):
+    above = elevation > 0
+    rises = np.flatnonzero(~above[:-1] & above[1:])
+    sets = np.flatnonzero(above[:-1] & ~above[1:])
+
+    # Pair each rise with the following set, dropping truncated passes
+    if rises.size == 0:
+        return []
+    sets = sets[np.searchsorted(sets, rises[0]) :]
+    count = min(rises.size, sets.size)
+    rises, sets = rises[:count], sets[:count]
+
+    # Locate the coarse peaks and skip hopeless passes early
+    peaks = np.array(
+        [
+            rise + 1 + np.argmax(elevation[rise + 1 : fall + 1])
+            for rise, fall in zip(rises, sets)
+        ],
+        dtype=int,
+    )
+    keep = elevation[peaks] > satellite.min_elevation - PEAK_SLACK
+    rises, sets, peaks = rises[keep], sets[keep], peaks[keep]
+    if rises.size == 0:
+        return []
+
+    aos = _refineCrossings(satrec, grid, location, grid.offsets[rises], True)
+    los = _refineCrossings(satrec, grid, location, grid.offsets[sets], False)
+    tca, max_elevation = _refineCulminations(
+        satrec,
+        grid,
+        location,
+        grid.offsets[peaks] - grid.step,
+        grid.offsets[peaks] + grid.step,
+    )
+
+    passes = list()
+    for i in range(rises.size):
+        if max_elevation[i] <= satellite.min_elevation:
+            continue
+        next_pass = Pass(
+            satellite,
+            grid.datetime(aos[i]),
+            grid.datetime(tca[i]),
+            grid.datetime(los[i]),
+            float(max_elevation[i]),
+        )
+        if next_pass.los > start and next_pass.aos < end:
+            passes.append(next_pass)
+    return passes
+
+
+# Sub-satellite points of a pass as rows of (seconds since AOS, latitude, longitude)
+def groundTrack(satellite, aos, los, step=TRACK_STEP):
+    grid = TimeGrid(aos, los, step)
+    fr = grid.fr + grid.offsets / 86400.0
+    _, positions, _ = _satrec(satellite).sgp4_array(
+        np.full(grid.offsets.shape, grid.jd), fr
+    )
+    x, y, z = _toEcef(positions, grid.jd + fr)
+
+    # Bowring's approximation of the geodetic latitude
+    p = np.sqrt(x * x + y * y)
+    theta = np.arctan(z * WGS84_A / (p * WGS84_B))
+    esq = 1.0 - (WGS84_B / WGS84_A) ** 2
+    epsq = (WGS84_A / WGS84_B) ** 2 - 1.0
+    lat = np.arctan(
+        (z + epsq * WGS84_B * np.sin(theta) ** 3)
+        / (p - esq * WGS84_A * np.cos(theta) ** 3)
+    )
+    lon = np.arctan2(y, x)
+    return np.column_stack((grid.offsets, np.degrees(lat), np.degrees(lon)))
+
+
+# Distance in km from the location to the satellite as (offsets, ranges), sampled every step seconds
+def slantRange(satellite, start, end, location=None, step=1):
+    if location is None:
+        location = config.location
+    grid = TimeGrid(start, end, step)
+    fr = grid.fr + grid.offsets / 86400.0
+    _, positions, _ = _satrec(satellite).sgp4_array(
+        np.full(grid.offsets.shape, grid.jd), fr
+    )
+    x, y, z = _toEcef(positions, grid.jd + fr)
+    station = location.position_ecef
+    ranges = np.sqrt(
+        (x - station[0]) ** 2 + (y - station[1]) ** 2 + (z - station[2]) ** 2
+    )
+    return grid.offsets, ranges
+
+
+# Build an SGP4 propagator from the satellite's current elements
+def _satrec(satellite):
+    if not satellite.has_tle():
+        raise LookupError(f"No TLE for {satellite.verbose_name}")
+    return Satrec.twoline2rv(satellite.tle_1, satellite.tle_2, WGS84)
+
+
+# Predict every pass of the satellites over the horizon, sorted by AOS
+def predictPasses(satellites, location=None, start=None, days=None, step=GRID_STEP):
+    if location is None:
+        location = config.location
+    if start is None:
+        start = datetime.utcnow()
+    if days is None:
+        days = config.prediction_horizon
+    end = start + timedelta(days=days)
+
+    grid = TimeGrid(start - MARGIN, end + MARGIN, step)
+    satrecs = [_satrec(satellite) for satellite in satellites]
+
+    passes = list()
+    for i in range(0, len(satrecs), BATCH_SIZE):
+        batch = satrecs[i : i + BATCH_SIZE]
+        elevations = _sweep(batch, grid, location)
+        for j, satrec in enumerate(batch):
+            passes += _findPasses(
+                satellites[i + j], satrec, elevations[j], grid, location, start, end
+            )
+
+    passes.sort()
+    logger.info(
+        f"Predicted {len(passes)} passes of {len(satellites)} satellite(s) "
+        f"over {days} day(s)"
+    )
+    return passes
@@ -0,0 +1,164 @@
+import http.client
+import io
+import logging
+import os
+import urllib.parse
+from queue import Full, Queue
+from threading import Thread, Timer
+
+from PIL import Image
+
+import metrics
+
+logger = logging.getLogger("main.publisher")
+
+# JPEG qualities tried when fitting an image in the size limit
+MIN_QUALITY = 40
+MAX_QUALITY = 95
+
+# Files worth publishing
+IMAGES = (".png", ".jpg", ".jpeg")
+
+
+# Largest JPEG quality giving at most max_bytes, found by bisection. The image
+# is shrunk when even the lowest quality is too large.
+def encodeJPEG(path, max_bytes):
+    with Image.open(path) as image:
+        image = image.convert("RGB")
+
+    while True:
+        best = None
+        low, high = MIN_QUALITY, MAX_QUALITY
+        while low <= high:
+            quality = (low + high) // 2
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True)
+            if buffer.tell() <= max_bytes:
+                best = buffer.getvalue()
+                low = quality + 1
+            else:
+                high = quality - 1
+        if best is not None:
+            return best
+
+        # Scale the area in proportion to the excess, with some slack
+        scale = min(0.9, (max_bytes / buffer.tell()) ** 0.5)
+        width, height = image.size
+        image = image.resize((max(1, int(width * scale)), max(1, int(height * scale))))
+
+
+# Posts images to Twitter through a client authenticated once
+class TwitterBackend:
+    def __init__(self):
+        import tweepy
+
+        auth = tweepy.OAuthHandler(
+            os.environ.get("API_KEY"), os.environ.get("API_SECRET_KEY")
+        )
+        auth.set_access_token(
+            os.environ.get("ACCESS_TOKEN"), os.environ.get("ACCESS_TOKEN_SECRET")
+        )
+        self.api = tweepy.API(auth)
+        self.api.verify_credentials()
+
+    def publish(self, name, data):
+        media = self.api.media_upload(name, file=io.BytesIO(data))
+        self.api.update_status(status="", media_ids=[media.media_id])
+
+
+# POSTs images to an HTTP endpoint over a kept-alive connection, for custom
+# galleries or to test against a local server
+class HTTPBackend:
+    def __init__(self, url, token=""):
+        self.url = urllib.parse.urlsplit(url)
+        self.token = token
+        self.connection = None
+
+    def _connect(self):
+        if self.url.scheme == "https":
+            return http.client.HTTPSConnection(self.url.netloc, timeout=60)
+        return http.client.HTTPConnection(self.url.netloc, timeout=60)
+
+    def publish(self, name, data):
+        headers = {"Content-Type": "image/jpeg", "X-Filename": name}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+
+        # A kept-alive connection may have been closed by the server meanwhile
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = self._connect()
+            try:
+                self.connection.request("POST", self.url.path or "/", data, headers)
+                response = self.connection.getresponse()
+                response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt == 1:
+                    raise
+        if response.status >= 300:
+            raise IOError(f"{self.url.geturl()} answered {response.status}")
+
+
+# Publishes pass images from a queue on a background thread, with a single
+# long-lived backend
+class Publisher:
+    def __init__(self, backend, max_bytes, queue_size, retries, retry_delay):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = Queue(maxsize=queue_size)
+        self.thread = None
+
+    def start(self):
+        self.thread = Thread(target=self._work, name="publisher", daemon=True)
+        self.thread.start()
+
+    def submit(self, files):
+        for path in files:
+            if path.lower().endswith(IMAGES):
+                self._put(path, 0)
+
+    def _put(self, path, attempt):
+        try:
+            self.queue.put_nowait((path, attempt))
+        except Full:
+            logger.error(f"Publishing queue full, dropping '{path}'")
+            metrics.increment("auto137_published_total", outcome="dropped")
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def _work(self):
+        while True:
+            path, attempt = self.queue.get()
+            try:
+                self._publish(path, attempt)
+            finally:
+                self.queue.task_done()
+
+    def _publish(self, path, attempt):
+        try:
+            with metrics.timed("publishing"):
+                data = encodeJPEG(path, self.max_bytes)
+                name = os.path.splitext(os.path.basename(path))[0] + ".jpg"
+                self.backend.publish(name, data)
+        except FileNotFoundError:
+            logger.error(f"'{path}' disappeared before being published")
+            return
+        except Exception as ex:
+            if attempt >= self.retries:
+                logger.error(f"Failed to publish '{path}', giving up: {ex}")
+                metrics.increment("auto137_published_total", outcome="failed")
+                return
+            delay = self.retry_delay * 2**attempt
+            logger.warning(f"Failed to publish '{path}', retrying in {delay}s: {ex}")
+            timer = Timer(delay, self._put, [path, attempt + 1])
+            timer.daemon = True
+            timer.start()
+            return
+        logger.info(f"Published '{path}' ({len(data) // 1024}KB)")
+        metrics.increment("auto137_published_total", outcome="done")
@@ -0,0 +1,193 @@
+import logging
+import os
+
+import config
+import core
+import passutils
+import tle
+
+logger = logging.getLogger("main.reloader")
+
+# Seconds between checks of the configuration file
+RELOAD_INTERVAL = 10
+
+# Settings only read at startup, keeping their value until a restart
+RESTART = (
+    "output_dir",
+    "radios",
+    "fast_start",
+    "hot_reload",
+    "decoding_workers",
+    "decoding_timeout",
+    "decoding_queue_size",
+    "rss_enabled",
+    "rss_webserver",
+    "rss_port",
+    "metrics_enabled",
+    "metrics_port",
+    "fleet_coordinator",
+    "fleet_port",
+    "post_processing_hook_enabled",
+    "post_processing_hook_command",
+    "post_processing_hook_foreach",
+    "post_processing_hook_workers",
+    "post_processing_hook_queue_size",
+    "post_processing_hook_timeout",
+    "post_processing_hook_retries",
+    "post_processing_hook_retry_delay",
+    "post_processing_hook_batch_window",
+    "publisher_enabled",
+    "publisher_backend",
+    "publisher_url",
+    "publisher_token",
+    "publisher_max_size",
+    "publisher_queue_size",
+    "publisher_retries",
+    "publisher_retry_delay",
+)
+
+# Settings changing which passes are planned
+PLANNING = (
+    "location",
+    "prediction_horizon",
+    "maximum_overlap",
+    "fleet_enabled",
+    "fleet_url",
+    "fleet_station",
+)
+
+# Modification time and size of the file when last loaded
+loaded = None
+
+
+def _stamp():
+    try:
+        stat = os.stat(config.config_file)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+# Comparable form of the settings that are objects
+def _comparable(name, value):
+    if name == "radios":
+        return [(radio.device, radio.ppm) for radio in value]
+    if name == "location":
+        return (value.latitude_deg, value.longitude_deg, value.elevation_m)
+    return value
+
+
+def _describe(satellite):
+    return (
+        satellite.verbose_name,
+        satellite.priority,
+        satellite.min_elevation,
+        satellite.frequency,
+        satellite.downlink,
+        satellite.delete_processed_files,
+        satellite.max_size_mb,
+    )
+
+
+# Watch the configuration file from the scheduler, in the memory store so the
+# job ends with the run
+def start():
+    global loaded
+    loaded = _stamp()
+    core.scheduler.add_job(
+        check,
+        "interval",
+        id="config_reload",
+        seconds=RELOAD_INTERVAL,
+        jobstore="memory",
+        replace_existing=True,
+    )
+
+
+def check():
+    global loaded
+    stamp = _stamp()
+    if stamp is None or stamp == loaded:
+        return
+    loaded = stamp
+    try:
+        values = config.parseConfig(config.config_file)
+    except (OSError, config.ConfigError) as ex:
+        logger.error(f"Keeping the current configuration: {ex}")
+        return
+    reload(values)
+
+
+# Apply a new configuration, predicting and scheduling again only what it
+# changed. Recordings in progress and queued decodings keep the satellites
+# they were started with.
+def reload(values):
+    for name in RESTART:
+        current = getattr(config, name)
+        if _comparable(name, values[name]) != _comparable(name, current):
+            logger.warning(f"{name} changed, restart Auto137 to apply it")
+        values[name] = current
+    replanned = [
+        name
+        for name in PLANNING
+        if _comparable(name, values[name]) != _comparable(name, getattr(config, name))
+    ]
+
+    # Unchanged satellites are kept whole, with their elements and cached
+    # passes. Changed ones keep their elements, passes being predicted again
+    # only if their cache key, like the minimum elevation, changed.
+    previous = {satellite.norad: satellite for satellite in config.satellites}
+    satellites = list()
+    changed = list()
+    for satellite in values["satellites"]:
+        old = previous.pop(satellite.norad, None)
+        if old is not None and _describe(old) == _describe(satellite):
+            satellites.append(old)
+            continue
+        if old is not None:
+            satellite.tle_1, satellite.tle_2 = old.tle_1, old.tle_2
+        satellites.append(satellite)
+        changed.append(satellite)
+    removed = list(previous.values())
+    values["satellites"] = satellites
+
+    interval = values["tle_update_interval"]
+    if interval != config.tle_update_interval:
+        core.scheduler.reschedule_job("tle_refresh", trigger="interval", hours=interval)
+
+    resize_feed = values["rss_max_items"] != config.rss_max_items
+    config.applyConfig(values)
+    if resize_feed and config.rss_enabled:
+        import rss
+
+        rss.resizeItems()
+    for satellite in changed:
+        logger.info(f"{satellite.verbose_name} changed")
+    for satellite in removed:
+        logger.info(f"{satellite.verbose_name} removed")
+    if replanned:
+        logger.info(f"{', '.join(replanned)} changed")
+    if not changed and not removed and not replanned:
+        logger.info("Configuration reloaded, the schedule is unchanged")
+        return
+
+    # Satellites that were just added need their elements
+    missing = [satellite for satellite in changed if not satellite.has_tle()]
+    if missing and not tle.applyCached(missing):
+        tle.refresh(missing)
+
+    reschedule()
+    logger.info("Configuration reloaded")
+
+
+# Plan again, then drop the scheduled passes the new plan no longer has
+def reschedule():
+    passutils.updatePass()
+    planned = set(
+        passutils.passJobId(planned.satellite.norad, planned.passobj.aos)
+        for planned in passutils.plan.planned
+    )
+    for job in core.scheduler.get_jobs():
+        if job.id.startswith("pass-") and job.id not in planned:
+            logger.info(f"Unscheduled {job.id}, no longer planned")
+            job.remove()
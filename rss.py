@@ -1,28 +1,75 @@
 import config
 import PyRSS2Gen
-import http.server
-import socketserver
+import json
+import os
 import core
-from datetime import datetime
-from threading import Thread
-
-# Our rss generator
-rss = PyRSS2Gen.RSS2(
-    title="Satellite station images",
-    link="",
-    description="Images from the station",
-    lastBuildDate=datetime.now(),
-    items=[]
-    )
+import webserver
+from collections import deque
+from datetime import datetime, timezone
+from threading import Lock, Thread
+
+# Feed items, oldest first, bounded to the configured history and restored from the JSON feed
+items = deque()
+items_loaded = False
+feed_lock = Lock()
 
 # Http server
 httpd = 0
 server_thread = 0
 
-# We need to set out directory
-class HTTPHandler(http.server.SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory=config.output_dir, **kwargs)
+# Write a file through a temporary one so readers never see it half-written
+def atomicWrite(path, write):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        write(f)
+    os.replace(temp_path, path)
+
+# Restore the items of a previous run from the JSON feed
+def loadItems():
+    global items, items_loaded
+
+    items_loaded = True
+    items = deque(maxlen=config.rss_max_items)
+    try:
+        with open(config.output_dir + "/feed.json", encoding="utf-8") as f:
+            items.extend(reversed(json.load(f)["items"]))
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+# Bound the loaded items to a new history size, like after a reload
+def resizeItems():
+    global items
+
+    with feed_lock:
+        if items_loaded and items.maxlen != config.rss_max_items:
+            items = deque(items, maxlen=config.rss_max_items)
+            writeFeeds()
+
+# Write both the RSS and the JSON feeds from the current items
+def writeFeeds():
+    rss = PyRSS2Gen.RSS2(
+        title="Satellite station images",
+        link="",
+        description="Images from the station",
+        lastBuildDate=datetime.now(),
+        items=[
+            PyRSS2Gen.RSSItem(
+                title = item["title"],
+                link = "",
+                description = item["content_html"],
+                guid = PyRSS2Gen.Guid(item["id"], isPermaLink=False),
+                pubDate = datetime.fromisoformat(item["date_published"]))
+            for item in reversed(items)
+        ]
+        )
+    feed = {
+        "version": "https://jsonfeed.org/version/1.1",
+        "title": "Satellite station images",
+        "description": "Images from the station",
+        "items": list(reversed(items)),
+    }
+    atomicWrite(config.output_dir + "/rss.xml", lambda f: rss.write_xml(f, "utf-8"))
+    atomicWrite(config.output_dir + "/feed.json", lambda f: json.dump(feed, f, indent=1))
 
 # Function for adding passes
 def addRSSPass(satellite, filename, date, passobj):
@@ -32,27 +79,30 @@ def addRSSPass(satellite, filename, date, passobj):
     if satellite.downlink == "APT":
         image = "Visible + Infrared : <\p>" + "<img src=\"" + filename + ".png\">"
     elif satellite.downlink == "LRPT":
-        image = "Visible : <\p>" + "<img src=\"" + filename + " - Visible.png\">" + "<\p>" + "Infrared : <\p>" + "<img src=\"" + filename + " - Infrared.png\">"
+        image = "Visible : <\p>" + "<img src=\"" + filename + "-Visible.png\">" + "<\p>" + "Infrared : <\p>" + "<img src=\"" + filename + "-Infrared.png\">"
 
-    # Add it to the feed
-    rss.items.append(PyRSS2Gen.RSSItem(
-        title = satellite.name + " on " + date.strftime('%H:%-M %d, %b %Y') + " (" + str(passobj.max_elevation_deg) + "°)",
-        link = "",
-        description = image,
-        guid = PyRSS2Gen.Guid(""),
-        pubDate = date)
-    )
+    # Add it to the feed, dropping the oldest item once full. A decoding resumed
+    # at startup may get here before the server, the history then loads first.
+    with feed_lock:
+        if not items_loaded:
+            loadItems()
+        items.append({
+            "id": filename,
+            "title": satellite.name + " on " + date.strftime('%H:%-M %d, %b %Y') + " (" + str(round(passobj.max_elevation_deg)) + "°)",
+            "content_html": image,
+            "date_published": date.replace(tzinfo=timezone.utc).isoformat(),
+        })
 
-    # Write the file to push the update
-    rss.write_xml(open(config.output_dir + "/rss.xml", "w"))
+        # Write the files to push the update
+        writeFeeds()
 
 # Used for the startup procedure
 def startServer():
-    global rss, httpd, server_thread
+    global httpd, server_thread
 
     if config.rss_webserver:
         # Configure the http server
-        httpd = socketserver.TCPServer(("", config.rss_port), HTTPHandler)
+        httpd = webserver.OutputServer(("", config.rss_port), webserver.OutputHandler)
         print("Starting http server at " + str(config.rss_port))
         print("\n")
 
@@ -60,5 +110,8 @@ def startServer():
         server_thread = Thread(target = httpd.serve_forever)
         server_thread.start()
 
-    # Write the file to make the feed readable
-    rss.write_xml(open(config.output_dir + "/rss.xml", "w"))
+    # Write the files to make the feeds readable
+    with feed_lock:
+        if not items_loaded:
+            loadItems()
+        writeFeeds()
@@ -0,0 +1,65 @@
+import json
+import logging
+import os
+from datetime import datetime
+
+import config
+from core import Recording
+from predict import Pass
+
+logger = logging.getLogger("main.snapshot")
+
+
+def _path():
+    return os.path.join(config.output_dir, "decoding.json")
+
+
+# Save the recordings waiting to be decoded, called on every queue change
+def savePending(recordings):
+    pending = [
+        {
+            "norad": recording.satellite.norad,
+            "filename": recording.filename,
+            "date": recording.date.isoformat(),
+            "aos": recording.passobj.aos.isoformat(),
+            "tca": recording.passobj.tca.isoformat(),
+            "los": recording.passobj.los.isoformat(),
+            "max_elevation": recording.passobj.max_elevation_deg,
+            "summary": recording.summary,
+        }
+        for recording in recordings
+    ]
+    temp_path = _path() + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(pending, f, indent=1, default=str)
+    os.replace(temp_path, _path())
+
+
+# Recordings left undecoded by the previous run, oldest first
+def loadPending():
+    try:
+        with open(_path(), encoding="utf-8") as f:
+            pending = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return list()
+
+    satellites = {satellite.norad: satellite for satellite in config.satellites}
+    recordings = list()
+    for job in pending:
+        satellite = satellites.get(job["norad"])
+        if satellite is None:
+            logger.warning(f"Dropping decoding of '{job['filename']}', unknown satellite")
+            continue
+        passobj = Pass(
+            satellite,
+            datetime.fromisoformat(job["aos"]),
+            datetime.fromisoformat(job["tca"]),
+            datetime.fromisoformat(job["los"]),
+            job["max_elevation"],
+        )
+        recording = Recording(
+            satellite, job["filename"], datetime.fromisoformat(job["date"]), passobj
+        )
+        recording.summary.update(job.get("summary", {}))
+        recordings.append(recording)
+    return recordings
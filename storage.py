@@ -0,0 +1,219 @@
+import logging
+import os
+import re
+import shutil
+from datetime import datetime, timedelta
+from queue import Queue
+from threading import Lock, Thread
+
+import config
+import core
+import decoding
+import metrics
+
+logger = logging.getLogger("main.storage")
+
+# Bytes written per second of recording
+RECORDING_RATES = {"APT": 48000 * 2, "LRPT": 140000 * 4}
+
+# Files modified this recently may still be written to
+ACTIVE_WINDOW = timedelta(minutes=10)
+
+# Files of a pass all start with the satellite name and the pass date
+PASS_PATTERN = re.compile(r"^(?P<name>.+)_(?P<date>\d{8}-\d{6})")
+
+MB = 1 << 20
+
+# Recordings waiting to be compressed, by a single background thread
+archive_queue = Queue()
+archive_thread = None
+archive_lock = Lock()
+enforce_lock = Lock()
+
+
+# Files of a single pass
+class PassFiles:
+    def __init__(self, base, date, paths):
+        self.base = base
+        self.date = date
+        self.paths = paths
+
+    @property
+    def size(self):
+        return sum(_size(path) for path in self.paths)
+
+    def active(self, protected):
+        if os.path.realpath(self.base) in protected:
+            return True
+        newest = max((_mtime(path) for path in self.paths), default=0)
+        return datetime.now() - datetime.fromtimestamp(newest) < ACTIVE_WINDOW
+
+    def remove(self, reason):
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        logger.info(f"Removed {os.path.basename(self.base)}: {reason}")
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+
+# Passes of a satellite, oldest first
+def _passes(satellite):
+    directory = os.path.join(config.output_dir, satellite.name)
+    groups = dict()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return list()
+    for name in names:
+        match = PASS_PATTERN.match(name)
+        if match is None:
+            continue
+        base = os.path.join(directory, match.group("name") + "_" + match.group("date"))
+        date = datetime.strptime(match.group("date"), "%Y%m%d-%H%M%S")
+        groups.setdefault((date, base), list()).append(os.path.join(directory, name))
+    return [
+        PassFiles(base, date, paths) for (date, base), paths in sorted(groups.items())
+    ]
+
+
+def freeSpace():
+    return shutil.disk_usage(config.output_dir).free
+
+
+# Recordings still queued for decoding must be kept whole. Their paths are
+# normalized, a recording being named from output_dir as configured.
+def _protected():
+    if core.decoder is None:
+        return set()
+    with core.decoder.jobs_lock:
+        filenames = [recording.filename for recording in core.decoder.jobs.values()]
+    return set(os.path.realpath(filename) for filename in filenames if filename)
+
+
+# Remove old passes, then the oldest ones of each satellite over its quota,
+# then the oldest ones of all satellites over the global quota
+def enforce():
+    with enforce_lock:
+        protected = _protected()
+        now = datetime.utcnow()
+        kept = list()
+        for satellite in config.satellites:
+            passes = [p for p in _passes(satellite) if not p.active(protected)]
+            if config.storage_max_age > 0:
+                limit = now - timedelta(days=config.storage_max_age)
+                for passfiles in [p for p in passes if p.date < limit]:
+                    passfiles.remove(f"older than {config.storage_max_age} days")
+                    passes.remove(passfiles)
+            if satellite.max_size_mb > 0:
+                _trim(passes, satellite.max_size_mb * MB, f"{satellite.name} quota")
+            kept += passes
+
+        if config.storage_max_size > 0:
+            kept.sort(key=lambda passfiles: passfiles.date)
+            _trim(kept, config.storage_max_size * MB, "global quota")
+
+        metrics.setGauge("auto137_storage_bytes", sum(p.size for p in kept))
+        metrics.setGauge("auto137_storage_free_bytes", freeSpace())
+
+
+# Remove the oldest passes until the others fit in quota bytes
+def _trim(passes, quota, reason):
+    sizes = [passfiles.size for passfiles in passes]
+    total = sum(sizes)
+    while passes and total > quota:
+        total -= sizes.pop(0)
+        passes.pop(0).remove(f"over the {reason}")
+
+
+# Whether there is room for a recording of that many seconds, keeping the
+# configured free space
+def canRecord(satellite, seconds):
+    needed = RECORDING_RATES.get(satellite.downlink, 0) * max(0, seconds)
+    free = freeSpace() - config.storage_min_free * MB
+    if needed <= free:
+        return True
+
+    # Quotas may free some room
+    enforce()
+    free = freeSpace() - config.storage_min_free * MB
+    if needed <= free:
+        return True
+    logger.error(
+        f"Not recording {satellite.name}: {needed // MB}MB needed, "
+        f"{max(0, free) // MB}MB available above the {config.storage_min_free}MB reserve"
+    )
+    return False
+
+
+# Commands compressing the raw recording of a pass, if kept
+def _archiveCommands(base):
+    commands = list()
+    if os.path.exists(base + ".wav"):
+        commands.append(
+            (
+                base + ".wav",
+                f"ffmpeg -hide_banner -loglevel error -y -i '{base}.wav' "
+                f"-c:a flac '{base}.flac'",
+            )
+        )
+    if os.path.exists(base + ".raw"):
+        if shutil.which("zstd") is None:
+            logger.warning("zstd not found, raw IQ recordings are kept uncompressed")
+        else:
+            commands.append(
+                (
+                    base + ".raw",
+                    f"zstd -q -T1 -3 --rm -f '{base}.raw' -o '{base}.raw.zst'",
+                )
+            )
+    return commands
+
+
+def _archive():
+    while True:
+        base = archive_queue.get()
+        try:
+            for source, command in _archiveCommands(base):
+                size = _size(source)
+                returncode = decoding.run(command)
+                if returncode != 0:
+                    logger.error(
+                        f"Compressing '{source}' failed with code {returncode}"
+                    )
+                    continue
+                # zstd removes its input itself
+                if os.path.exists(source):
+                    os.remove(source)
+                logger.info(f"Compressed '{source}' ({size // MB}MB)")
+        except Exception:
+            logger.exception(f"Compressing '{base}' failed")
+        finally:
+            archive_queue.task_done()
+
+
+# Compress the raw files left by a decoded pass in the background
+def archive(base):
+    global archive_thread
+
+    if not config.storage_compress_raw:
+        return
+    with archive_lock:
+        if archive_thread is None:
+            archive_thread = Thread(target=_archive, name="archiver", daemon=True)
+            archive_thread.start()
+    archive_queue.put(base)
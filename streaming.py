@@ -0,0 +1,49 @@
+import logging
+from threading import Thread
+
+logger = logging.getLogger("main.streaming")
+
+# Size of the reads from the receiver, about a second of 140 ksps IQ
+CHUNK_SIZE = 1 << 19
+
+
+# Copy a receiver's output to every sink until it stops, then close them.
+# An optional transform is applied to each chunk before it is written.
+class StreamPump(Thread):
+    def __init__(self, source, sinks, transform=None):
+        super().__init__(daemon=True)
+        self.source = source
+        self.sinks = sinks
+        self.transform = transform
+        self.bytes_copied = 0
+
+    def run(self):
+        try:
+            while True:
+                chunk = self.source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if self.transform is not None:
+                    chunk = self.transform(chunk)
+                for sink in list(self.sinks):
+                    try:
+                        sink.write(chunk)
+                    except BrokenPipeError:
+                        # A consumer died, keep feeding the others
+                        logger.error(f"Stream consumer {sink} closed early")
+                        self.sinks.remove(sink)
+                self.bytes_copied += len(chunk)
+        finally:
+            for sink in self.sinks:
+                try:
+                    sink.close()
+                except BrokenPipeError:
+                    pass
+            self.source.close()
+
+
+# Start pumping source into sinks in the background
+def pump(source, sinks, transform=None):
+    stream_pump = StreamPump(source, sinks, transform)
+    stream_pump.start()
+    return stream_pump
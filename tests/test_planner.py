@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta
+
+import config  # noqa: F401, loads core without the import cycle
+import core
+import planner
+from predict import Pass
+
+START = datetime(2024, 1, 1)
+
+
+def _pass(name, start_min, end_min, elevation=45, priority=0):
+    satellite = core.Satellite(name, 0, priority, 10, 137.1, "APT", False)
+    aos = START + timedelta(minutes=start_min)
+    los = START + timedelta(minutes=end_min)
+    return Pass(satellite, aos, aos + (los - aos) / 2, los, elevation)
+
+
+def test_overlapping_passes_use_both_radios_untrimmed():
+    first = _pass("NOAA 15", 0, 15)
+    second = _pass("NOAA 18", 10, 25)
+    plan = planner.planPasses([first, second], maximum_overlap=10, radios=2)
+
+    assert [p.passobj for p in plan.planned] == [first, second]
+    assert not any(p.trimmed for p in plan.planned)
+    assert set(p.radio for p in plan.planned) == {0, 1}
+    assert plan.dropped == []
+
+
+def test_trims_only_when_every_radio_is_busy():
+    first = _pass("NOAA 15", 0, 15)
+    second = _pass("NOAA 18", 5, 20)
+    third = _pass("NOAA 19", 12, 27)
+    plan = planner.planPasses([first, second, third], maximum_overlap=5, radios=2)
+
+    assert len(plan.planned) == 3
+    trimmed = [p for p in plan.planned if p.trimmed]
+    assert [p.passobj for p in trimmed] == [first]
+    assert trimmed[0].los == third.aos
+
+
+def test_single_radio_trims_to_next_pass():
+    first = _pass("NOAA 15", 0, 15)
+    second = _pass("NOAA 18", 12, 27)
+    plan = planner.planPasses([first, second], maximum_overlap=5, radios=1)
+
+    assert [p.los for p in plan.planned] == [second.aos, second.los]
+    assert plan.dropped == []
+
+
+def test_report_only_covers_the_window():
+    first = _pass("NOAA 15", 0, 15)
+    second = _pass("NOAA 18", 12, 27)
+    third = _pass("NOAA 19", 13, 20, elevation=10)
+    plan = planner.planPasses([first, second, third], maximum_overlap=5, radios=1)
+
+    lines = plan.report()
+    assert len(lines) == 2
+    assert lines[0].startswith("Trimmed NOAA_15 pass")
+    assert lines[1].startswith("Dropped NOAA_19 pass")
+    assert plan.report(START + timedelta(minutes=13)) == lines[1:]
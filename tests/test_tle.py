@@ -0,0 +1,38 @@
+import config
+import core
+import tle
+
+LINE1 = "1 33591U 09005A   24001.50000000  .00000100  00000-0  80000-4 0  9993"
+LINE2 = "2 33591  99.1900 300.0000 0013000 200.0000 160.0000 14.12800000900004"
+
+
+def _satellite(name, norad):
+    return core.Satellite(name, norad, 0, 20, 137.1, "APT", False)
+
+
+def test_failed_group_keeps_cached_elements(tmp_path, monkeypatch):
+    url = tle.CELESTRAK_GROUP.format("weather")
+    monkeypatch.setattr(config, "output_dir", str(tmp_path))
+    monkeypatch.setattr(config, "tle_file", "")
+    monkeypatch.setattr(config, "tle_groups", ["weather"])
+    monkeypatch.setattr(config, "tle_max_age", 10000)
+    monkeypatch.setattr(tle, "loaded", True)
+    monkeypatch.setattr(tle, "validators", {url: {"norads": [33591]}})
+    monkeypatch.setattr(tle, "catalog", dict())
+    tle._merge(33591, "NOAA 19", LINE1, LINE2)
+
+    def failing(url):
+        raise OSError("Service unavailable")
+
+    singles = list()
+    monkeypatch.setattr(tle, "_fetchGroup", failing)
+    monkeypatch.setattr(tle, "_fetchSingle", singles.append)
+
+    cached = _satellite("NOAA 19", 33591)
+    tle.refresh([cached])
+    assert singles == []
+    assert (cached.tle_1, cached.tle_2) == (LINE1, LINE2)
+
+    # Only a satellite no group ever held is fetched on its own
+    tle.refresh([cached, _satellite("METEOR-M 2", 40069)])
+    assert singles == [40069]
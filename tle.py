@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from threading import Lock
+
+import config
+
+logger = logging.getLogger("main.tle")
+
+CELESTRAK_GROUP = "https://celestrak.org/NORAD/elements/gp.php?GROUP={}&FORMAT=tle"
+FETCH_TIMEOUT = 30
+FETCH_WORKERS = 4
+
+# Latest elements of each satellite by NORAD id, with the validators of the
+# group files they came from, persisted so the station can start offline
+catalog = dict()
+validators = dict()
+catalog_lock = Lock()
+loaded = False
+
+
+# Epoch of an element set, from its first line
+def epoch(line1):
+    year, day = int(line1[18:20]), float(line1[20:32])
+    year += 2000 if year < 57 else 1900
+    return datetime(year, 1, 1) + timedelta(days=day - 1)
+
+
+# Element sets of a 3 line TLE file, by NORAD id
+def parseTLEs(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    elements = dict()
+    for i, line in enumerate(lines):
+        if line.startswith("1 ") and i + 1 < len(lines):
+            line2 = lines[i + 1]
+            if not line2.startswith("2 ") or line2[2:7] != line[2:7]:
+                continue
+            name = (
+                lines[i - 1] if i > 0 and lines[i - 1][:2] not in ("1 ", "2 ") else ""
+            )
+            elements[int(line[2:7])] = (name, line, line2)
+    return elements
+
+
+def _path():
+    return os.path.join(config.output_dir, "tle.json")
+
+
+def loadCatalog():
+    global loaded
+
+    try:
+        with open(_path(), encoding="utf-8") as f:
+            data = json.load(f)
+        catalog.update((int(norad), entry) for norad, entry in data["catalog"].items())
+        validators.update(data["validators"])
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+    loaded = True
+
+
+def saveCatalog():
+    temp_path = _path() + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"catalog": catalog, "validators": validators}, f, indent=1)
+    os.replace(temp_path, _path())
+
+
+# Keep the newest of the cached and fetched elements of a satellite
+def _merge(norad, name, line1, line2):
+    entry = catalog.get(norad)
+    if entry is not None and entry["epoch"] > epoch(line1).isoformat():
+        return
+    catalog[norad] = {
+        "name": name,
+        "line1": line1,
+        "line2": line2,
+        "epoch": epoch(line1).isoformat(),
+        "fetched": datetime.utcnow().isoformat(),
+    }
+
+
+# Fetch a group file, sending the validators of the previous fetch so an
+# unchanged file costs Celestrak nothing. Returns the NORAD ids it covers.
+def _fetchGroup(url):
+    previous = validators.get(url, {})
+    request = urllib.request.Request(url, headers={"User-Agent": "Auto137"})
+    if "etag" in previous:
+        request.add_header("If-None-Match", previous["etag"])
+    if "last_modified" in previous:
+        request.add_header("If-Modified-Since", previous["last_modified"])
+
+    try:
+        with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+            text = response.read().decode("utf-8", "replace")
+            headers = response.headers
+    except urllib.error.HTTPError as ex:
+        if ex.code == 304:
+            logger.info(f"{url} unchanged")
+            return set(previous.get("norads", []))
+        raise
+
+    elements = parseTLEs(text)
+    if not elements:
+        raise ValueError(f"No TLE in {url}: {text[:80]!r}")
+    for norad, (name, line1, line2) in elements.items():
+        _merge(norad, name, line1, line2)
+    validators[url] = {"norads": sorted(elements)}
+    if headers.get("ETag"):
+        validators[url]["etag"] = headers["ETag"]
+    if headers.get("Last-Modified"):
+        validators[url]["last_modified"] = headers["Last-Modified"]
+    logger.info(f"Fetched {len(elements)} TLEs from {url}")
+    return set(elements)
+
+
+# Fetch a satellite missing from the group files on its own
+def _fetchSingle(norad):
+    from satellite_tle import fetch_tle
+
+    name, line1, line2 = fetch_tle.fetch_tle_from_celestrak(norad)
+    _merge(norad, name, line1, line2)
+
+
+def _readFile(path):
+    with open(path, encoding="utf-8") as f:
+        elements = parseTLEs(f.read())
+    for norad, (name, line1, line2) in elements.items():
+        _merge(norad, name, line1, line2)
+    logger.info(f"Read {len(elements)} TLEs from '{path}'")
+
+
+def _tryFetch(fetch, source):
+    try:
+        return fetch(source)
+    except Exception as ex:
+        logger.error(f"Failed to fetch TLEs of {source}, using the cached ones: {ex}")
+        return None
+
+
+# Refresh the catalog from the configured source, falling back on the cached
+# elements of the satellites that could not be fetched
+def refresh(satellites):
+    with catalog_lock:
+        if not loaded:
+            loadCatalog()
+
+        if config.tle_file:
+            try:
+                _readFile(config.tle_file)
+            except OSError as ex:
+                logger.error(f"Failed to read TLEs from '{config.tle_file}': {ex}")
+        else:
+            # A group that failed still covers the satellites it held last
+            # time, their cached elements being kept rather than fetched one
+            # by one while Celestrak is struggling
+            urls = [CELESTRAK_GROUP.format(group) for group in config.tle_groups]
+            covered = set()
+            with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+                results = pool.map(_tryFetch, [_fetchGroup] * len(urls), urls)
+                for url, result in zip(urls, results):
+                    if result is None:
+                        result = validators.get(url, {}).get("norads", [])
+                    covered |= set(result)
+
+                missing = [s.norad for s in satellites if s.norad not in covered]
+                list(pool.map(_tryFetch, [_fetchSingle] * len(missing), missing))
+
+        saveCatalog()
+        for satellite in satellites:
+            _apply(satellite)
+
+
+# Give the satellites their cached elements without fetching anything,
+# returning whether every one of them got some. Missing elements are left for
+# the caller to fetch or report.
+def applyCached(satellites):
+    with catalog_lock:
+        if not loaded:
+            loadCatalog()
+        for satellite in satellites:
+            _apply(satellite, logger.debug)
+    return all(satellite.has_tle() for satellite in satellites)
+
+
+# Hand its latest elements to a satellite, warning if they get old
+def _apply(satellite, report_missing=logger.error):
+    entry = catalog.get(satellite.norad)
+    if entry is None:
+        report_missing(f"No TLE for {satellite.verbose_name}, its passes are skipped")
+        return
+
+    satellite.set_tle(entry["line1"], entry["line2"])
+    age = datetime.utcnow() - datetime.fromisoformat(entry["epoch"])
+    if age > timedelta(days=config.tle_max_age):
+        logger.warning(
+            f"TLE of {satellite.verbose_name} is {age.days} days old, "
+            f"predictions will be inaccurate"
+        )
@@ -1,42 +1,30 @@
 import os
 import sys
-from PIL import Image
 import logging
-import tweepy
-from tweepy import TweepError
+
+from publisher import TwitterBackend, encodeJPEG
 
 # NOTE: Need to source the keys file to have the secrets available.
+# The publisher section of config.yaml does the same from within Auto137
+# without starting a process per image.
 if __name__ == "__main__":
     logging.basicConfig(filename="twitter_bot.log", level=logging.INFO, format='%(asctime)s : %(message)s')
-    auth = tweepy.OAuthHandler(
-        os.environ.get("API_KEY"), os.environ.get("API_SECRET_KEY")
-    )
-    auth.set_access_token(
-        os.environ.get("ACCESS_TOKEN"), os.environ.get("ACCESS_TOKEN_SECRET")
-    )
-
-    api = tweepy.API(auth)
 
     try:
-        api.verify_credentials()
-    except TweepError:
+        backend = TwitterBackend()
+    except Exception:
         logging.error("Auth failed")
         sys.exit(1)
 
     filename = sys.argv[1]
     # convert image to jpg to reduce size below 5Mb
     logging.info(f"Compressing image")
-    img = Image.open(filename)
-    jpeg_filename = filename.replace(".png", ".jpg")
-    img.convert("RGB").save(jpeg_filename, optimize=True, quality=90)
-
-    media = api.media_upload(jpeg_filename)
+    jpeg_filename = os.path.basename(filename).replace(".png", ".jpg")
+    data = encodeJPEG(filename, 5000 * 1024)
 
     try:
-        api.update_status(status="", media_ids=[media.media_id])
-    except TweepError as e:
+        backend.publish(jpeg_filename, data)
+    except Exception as e:
         logging.error(str(e))
-        os.remove(jpeg_filename)
         sys.exit(1)
     logging.info(f"Posted tweet with image {jpeg_filename}")
-    os.remove(jpeg_filename)
@@ -0,0 +1,186 @@
+import email.utils
+import gzip
+import http.server
+import io
+import os
+import re
+import time
+from threading import Thread
+
+import config
+import metrics
+
+# Text files worth compressing on the fly
+COMPRESSIBLE = (".xml", ".json", ".html", ".txt")
+
+# Pass images never change once their decoding is over, which can rewrite
+# them to correct their geometry
+IMMUTABLE = (".png", ".jpg", ".jpeg")
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+# Serves the output directory with conditional and partial requests
+class OutputHandler(http.server.SimpleHTTPRequestHandler):
+    def __init__(self, *args, **kwargs):
+        self.remaining = None
+        super().__init__(*args, directory=config.output_dir, **kwargs)
+
+    def _cacheHeaders(self, path, etag, last_modified, mtime):
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        settled = time.time() - mtime > config.decoding_timeout * 60
+        if path.endswith(IMMUTABLE) and settled:
+            self.send_header("Cache-Control", "public, max-age=31536000, immutable")
+        else:
+            self.send_header("Cache-Control", "no-cache")
+
+    def _notModified(self, etag, mtime):
+        if "If-None-Match" in self.headers:
+            tags = [tag.strip() for tag in self.headers["If-None-Match"].split(",")]
+            return etag in tags or "*" in tags
+        if "If-Modified-Since" in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers["If-Modified-Since"]
+                )
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since.timestamp()
+        return False
+
+    # Byte range asked for, None for the whole file or an invalid range
+    def _range(self, etag, size):
+        match = RANGE_PATTERN.match(self.headers.get("Range", "").strip())
+        if match is None or self.headers.get("If-Range", etag) != etag:
+            return None
+        first, last = match.groups()
+        if first == "":
+            if last == "":
+                return None
+            first, last = max(0, size - int(last)), size - 1
+        else:
+            first = int(first)
+            if last != "" and int(last) < first:
+                return None
+            last = size - 1 if last == "" else min(int(last), size - 1)
+        return first, last
+
+    def send_head(self):
+        self.remaining = None
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            return super().send_head()
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return None
+
+        try:
+            stat = os.fstat(f.fileno())
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            last_modified = self.date_time_string(stat.st_mtime)
+
+            # The compressed variant of a file has its own entity tag
+            compress = path.endswith(COMPRESSIBLE) and "gzip" in self.headers.get(
+                "Accept-Encoding", ""
+            )
+            if compress:
+                etag = etag[:-1] + '-gz"'
+
+            if self._notModified(etag, stat.st_mtime):
+                f.close()
+                self.send_response(304)
+                if path.endswith(COMPRESSIBLE):
+                    self.send_header("Vary", "Accept-Encoding")
+                self._cacheHeaders(path, etag, last_modified, stat.st_mtime)
+                self.end_headers()
+                return None
+
+            # Feeds are small, compress them whole in memory
+            if compress:
+                body = gzip.compress(f.read())
+                f.close()
+                self.send_response(200)
+                self.send_header("Content-Type", self.guess_type(path))
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Vary", "Accept-Encoding")
+                self._cacheHeaders(path, etag, last_modified, stat.st_mtime)
+                self.end_headers()
+                return io.BytesIO(body)
+
+            byte_range = self._range(etag, stat.st_size)
+            if byte_range is not None and byte_range[0] >= stat.st_size:
+                f.close()
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{stat.st_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return None
+
+            if byte_range is None:
+                self.send_response(200)
+                self.send_header("Content-Length", str(stat.st_size))
+            else:
+                first, last = byte_range
+                f.seek(first)
+                self.remaining = last - first + 1
+                self.send_response(206)
+                self.send_header(
+                    "Content-Range", f"bytes {first}-{last}/{stat.st_size}"
+                )
+                self.send_header("Content-Length", str(self.remaining))
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Accept-Ranges", "bytes")
+            if path.endswith(COMPRESSIBLE):
+                self.send_header("Vary", "Accept-Encoding")
+            self._cacheHeaders(path, etag, last_modified, stat.st_mtime)
+            self.end_headers()
+            return f
+        except Exception:
+            f.close()
+            raise
+
+    # Only copy the requested range, if any
+    def copyfile(self, source, outputfile):
+        if self.remaining is None:
+            return super().copyfile(source, outputfile)
+        while self.remaining > 0:
+            chunk = source.read(min(self.remaining, 64 * 1024))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            self.remaining -= len(chunk)
+        self.remaining = None
+
+
+# One thread per connection so a slow download never blocks the feed
+class OutputServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+# Serves the metrics in the Prometheus text format
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404, "Not found")
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Scrapes are frequent, keep them out of the console
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve the metrics in the background
+def startMetricsServer(port):
+    httpd = OutputServer(("", port), MetricsHandler)
+    Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    return httpd